@@ -1,9 +1,8 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-import asyncio
-from json import dumps
 from os import getenv, listdir
+from threading import Lock
 
 import awsiot.greengrasscoreipc.client as client
 import config_utils
@@ -13,12 +12,7 @@ from awsiot.eventstreamrpc import (Connection, LifecycleHandler,
                                    MessageAmendment)
 from awsiot.greengrasscoreipc.model import (
     ConfigurationUpdateEvents, GetConfigurationRequest,
-    PublishToIoTCoreRequest, SubscribeToConfigurationUpdateRequest)
-from stream_manager import (ExportDefinition, MessageStreamDefinition,
-                            ResourceNotFoundException, S3ExportTaskDefinition,
-                            S3ExportTaskExecutorConfig, StrategyOnFull,
-                            StreamManagerClient)
-from stream_manager.util import Util
+    SubscribeToConfigurationUpdateRequest)
 
 
 class IPCUtils:
@@ -44,75 +38,6 @@ class IPCUtils:
         connect_future.result(config_utils.TIMEOUT)
         return connection
 
-    def publish_results_to_cloud(self, PAYLOAD):
-        r"""
-        Ipc client creates a request and activates the operation to publish messages to the IoT core
-        with a qos type over a topic.
-
-        :param PAYLOAD: An dictionary object with inference results.
-        """
-        try:
-            request = PublishToIoTCoreRequest(
-                topic_name=config_utils.TOPIC,
-                qos=config_utils.QOS_TYPE,
-                payload=dumps(PAYLOAD).encode(),
-            )
-            print(PAYLOAD)
-            operation = ipc_client.new_publish_to_iot_core()
-            operation.activate(request).result(config_utils.TIMEOUT)
-            config_utils.logger.info("Publishing results to the IoT core...")
-            operation.get_response().result(config_utils.TIMEOUT)
-        except Exception as e:
-            config_utils.logger.info(
-                "Exception occured during publish: {}".format(e.message))
-
-    def upload_to_s3(self, local_image_path, s3_folder):
-        try:
-            stream_name = config_utils.STREAM_NAME
-            bucket_name = config_utils.UPLOAD_BUCKET_NAME
-
-            client = StreamManagerClient()
-
-            # Try deleting the stream (if it exists) so that we have a fresh start
-            try:
-                client.delete_message_stream(stream_name=stream_name)
-            except ResourceNotFoundException:
-                pass
-
-            exports = ExportDefinition(
-                s3_task_executor=[
-                    S3ExportTaskExecutorConfig(
-                        identifier="S3TaskExecutor" + stream_name
-                    )
-                ]
-            )
-
-            # Create the message stream with the S3 Export definition.
-            client.create_message_stream(
-                MessageStreamDefinition(
-                    name=stream_name, strategy_on_full=StrategyOnFull.OverwriteOldestData, export_definition=exports
-                )
-            )
-
-            file_url = "file://%s" % (local_image_path)
-
-            # Append a S3 Task definition and print the sequence number
-            s3_export_task_definition = S3ExportTaskDefinition(
-                input_url=file_url, bucket=bucket_name, key="{}{}".format(s3_folder, local_image_path.split("/")[-1]))
-            config_utils.logger.info(
-                "Successfully appended S3 Task Definition to stream with sequence number %d",
-                client.append_message(stream_name, Util.validate_and_serialize_to_json_bytes(
-                    s3_export_task_definition)),
-            )
-
-        except asyncio.TimeoutError:
-            config_utils.logger.exception("Timed out while executing")
-        except Exception:
-            config_utils.logger.exception("Exception while running")
-        finally:
-            if client:
-                client.close()
-
     def get_configuration(self):
         r"""
         Ipc client creates a request and activates the operation to get the configuration of
@@ -122,14 +47,14 @@ class IPCUtils:
         """
         try:
             get_config_request = GetConfigurationRequest()
-            operation = ipc_client.new_get_configuration()
+            operation = get_ipc_client().new_get_configuration()
             operation.activate(get_config_request).result(config_utils.TIMEOUT)
             result = operation.get_response().result(config_utils.TIMEOUT)
             return result.value
         except Exception as e:
             config_utils.logger.error(
                 "Exception occured during fetching the configuration: {}".format(
-                    e.message)
+                    e)
             )
             exit(1)
 
@@ -139,10 +64,10 @@ class IPCUtils:
         """
         try:
             config_subscribe_req = SubscribeToConfigurationUpdateRequest()
-            subscribe_operation = ipc_client.new_subscribe_to_configuration_update(
+            subscribe_operation = get_ipc_client().new_subscribe_to_configuration_update(
                 ConfigUpdateHandler()
             )
-            parent_subscribe_operation = ipc_client.new_subscribe_to_configuration_update(
+            parent_subscribe_operation = get_ipc_client().new_subscribe_to_configuration_update(
                 ConfigUpdateHandler()
             )
             subscribe_operation.activate(
@@ -151,7 +76,7 @@ class IPCUtils:
         except Exception as e:
             config_utils.logger.error(
                 "Exception occured during fetching the configuration updates: {}".format(
-                    e.message)
+                    e)
             )
             exit(1)
 
@@ -178,13 +103,27 @@ class ConfigUpdateHandler(client.SubscribeToConfigurationUpdateStreamHandler):
             "Config update subscription stream was closed")
 
 
-# Get the ipc client
-try:
-    ipc_client = client.GreengrassCoreIPCClient(IPCUtils().connect())
-    config_utils.logger.info("Created IPC client...")
-except Exception as e:
-    config_utils.logger.error(
-        "Exception occured during the creation of an IPC client: {}".format(
-            e.message)
-    )
-    exit(1)
+ipc_client = None
+ipc_client_lock = Lock()
+
+
+def get_ipc_client():
+    r"""
+    Returns the IPC client, connecting to the Greengrass nucleus on first use. The connection is not
+    made at import time, so that processes which only run inference can import this module.
+
+    :return: the GreengrassCoreIPCClient of this process.
+    """
+    global ipc_client
+    with ipc_client_lock:
+        if ipc_client is None:
+            try:
+                ipc_client = client.GreengrassCoreIPCClient(IPCUtils().connect())
+                config_utils.logger.info("Created IPC client...")
+            except Exception as e:
+                config_utils.logger.error(
+                    "Exception occured during the creation of an IPC client: {}".format(
+                        e)
+                )
+                exit(1)
+    return ipc_client
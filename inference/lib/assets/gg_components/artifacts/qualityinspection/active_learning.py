@@ -0,0 +1,123 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import heapq
+import math
+from itertools import count
+from threading import Lock
+from time import monotonic
+
+import config_utils
+from metrics import METRICS
+
+SAMPLER_STRATEGIES = ("off", "margin", "entropy")
+
+
+def box_confidences(boxes):
+    r"""
+    :param boxes: box details as returned by get_box_details with a min_confidence.
+    :return: the confidences of the boxes above the score threshold and of the candidate boxes below it.
+    """
+    confidences = list(boxes[0][0]) if boxes and boxes[0] else []
+    if len(boxes) > 2 and boxes[2]:
+        confidences += boxes[2][0]
+    return confidences
+
+
+def margin_score(confidences, threshold=config_utils.SCORE_THRESHOLD, min_confidence=0.0):
+    r"""
+    Scores how close the box nearest to the score threshold is to it, from either side. A box at
+    the threshold scores 1, a box at min_confidence or at confidence 1 scores 0.
+
+    :param confidences: confidences of the boxes.
+    :param threshold: score threshold of the published boxes.
+    :param min_confidence: lowest confidence of the candidate boxes.
+    :return: uncertainty between 0 and 1, 0 if there are no boxes.
+    """
+    score = 0.0
+    for confidence in confidences:
+        width = threshold - min_confidence if confidence < threshold else 1 - threshold
+        score = max(score, 1 - abs(confidence - threshold) / max(width, 1e-6))
+    return score
+
+
+def entropy_score(confidences):
+    r"""
+    Scores the highest binary entropy of the confidences of the boxes, which is 1 for a box the
+    model is as sure of as not.
+
+    :param confidences: confidences of the boxes.
+    :return: uncertainty between 0 and 1, 0 if there are no boxes.
+    """
+    score = 0.0
+    for confidence in confidences:
+        p = min(max(confidence, 1e-6), 1 - 1e-6)
+        score = max(score, -(p * math.log2(p) + (1 - p) * math.log2(1 - p)))
+    return score
+
+
+class ActiveLearningSampler:
+    r"""
+    Selects the frames to upload for labeling by the uncertainty of the model, within an upload
+    budget per hour. Offered frames are kept as candidates, the most uncertain first, and one
+    candidate is released every 3600 / budget seconds, so the budget goes to the hardest frames
+    seen in between. Frames without any box score 0 and are only released when nothing more
+    uncertain was offered.
+    """
+
+    def __init__(self, strategy, budget_per_hour, min_confidence,
+                 max_candidates=config_utils.SAMPLER_MAX_CANDIDATES):
+        r"""
+        :param strategy: one of SAMPLER_STRATEGIES other than off.
+        :param budget_per_hour: number of frames released per hour.
+        :param min_confidence: lowest confidence of the candidate boxes below the score threshold.
+        :param max_candidates: number of candidate frames kept in memory, the least uncertain are evicted first.
+        """
+        if strategy not in SAMPLER_STRATEGIES or strategy == "off":
+            raise ValueError("Unknown sampler strategy: {}".format(strategy))
+        self.strategy = strategy
+        self.min_confidence = min_confidence
+        self.period_secs = 3600 / max(budget_per_hour, 1e-6)
+        self.max_candidates = max(1, max_candidates)
+        # Min-heap of (score, order, frame), the least uncertain candidate on top
+        self._candidates = []
+        self._order = count()
+        self._lock = Lock()
+        self._next_release = monotonic()
+
+    def score(self, boxes):
+        r"""
+        :param boxes: box details as returned by get_box_details with a min_confidence.
+        :return: uncertainty of the model about the frame, between 0 and 1.
+        """
+        confidences = box_confidences(boxes)
+        if self.strategy == "margin":
+            return margin_score(confidences, config_utils.SCORE_THRESHOLD, self.min_confidence)
+        return entropy_score(confidences)
+
+    def offer(self, image_path, image, boxes):
+        r"""
+        :param image_path: path of the frame.
+        :param image: decoded frame.
+        :param boxes: box details of the frame.
+        :return: list of (image_path, image) tuples of the frames to upload for labeling now.
+        """
+        score = self.score(boxes)
+        with self._lock:
+            entry = (score, next(self._order), (image_path, image))
+            if len(self._candidates) < self.max_candidates:
+                heapq.heappush(self._candidates, entry)
+            else:
+                heapq.heappushpop(self._candidates, entry)
+            now = monotonic()
+            if now < self._next_release:
+                return []
+            self._next_release = max(self._next_release + self.period_secs, now)
+            # The most uncertain candidate is the largest entry of the heap
+            best = max(self._candidates)
+            self._candidates.remove(best)
+            heapq.heapify(self._candidates)
+        METRICS.count("sampled")
+        config_utils.logger.info(
+            "Sampled {} for labeling with uncertainty {:.3f}".format(best[2][0], best[0]))
+        return [best[2]]
@@ -0,0 +1,262 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+r"""
+Offline benchmark of the inference component. Replays the sample images through the real
+predict_batch path, with in-process stand-ins for the Greengrass IPC client and the StreamManager
+client, so that it runs on a development machine or in CI without a Greengrass nucleus.
+
+Every combination of inference engine and batch size runs in its own process, so that the peak
+RSS is reported per combination. For eg.:
+
+    python3 benchmark.py --model best.onnx --engines onnxruntime ultralytics --batch-sizes 1 4
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import sys
+import tempfile
+from concurrent.futures import Future
+from os import environ, path
+from queue import Empty
+from threading import Timer
+from time import perf_counter, sleep
+
+from stream_manager import NotEnoughMessagesException, ResourceNotFoundException
+from stream_manager.data import MessageStreamInfo
+
+COMPONENT_DIR = path.dirname(path.abspath(__file__))
+
+
+def completed_future(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class FakeOperation:
+    r"""
+    Stand-in for an IPC publish operation which records the published messages.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def activate(self, request):
+        # Completes asynchronously after the latency, like the IPC client
+        future = Future()
+
+        def complete():
+            self._client.messages += 1
+            self._client.payload_bytes += len(request.payload)
+            future.set_result(None)
+        Timer(self._client.latency_secs, complete).start()
+        return future
+
+    def get_response(self):
+        return completed_future()
+
+
+class FakeIPCClient:
+    r"""
+    Stand-in for GreengrassCoreIPCClient which accepts IoT Core publishes with a fixed latency.
+    """
+
+    def __init__(self, latency_secs):
+        self.latency_secs = latency_secs
+        self.messages = 0
+        self.payload_bytes = 0
+
+    def new_publish_to_iot_core(self):
+        return FakeOperation(self)
+
+
+class FakeStreamManagerClient:
+    r"""
+    Stand-in for StreamManagerClient which accepts S3 export tasks with a fixed latency per call
+    and never reports an export status.
+    """
+
+    latency_secs = 0.0
+    appended = 0
+    # Definitions of the created streams by name, shared by the clients of the process
+    streams = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def describe_message_stream(self, stream_name):
+        sleep(self.latency_secs)
+        if stream_name not in FakeStreamManagerClient.streams:
+            raise ResourceNotFoundException()
+        return MessageStreamInfo(
+            definition=FakeStreamManagerClient.streams[stream_name],
+            storage_status=MessageStreamInfo.storageStatus())
+
+    def create_message_stream(self, definition):
+        sleep(self.latency_secs)
+        FakeStreamManagerClient.streams[definition.name] = definition
+
+    def update_message_stream(self, definition):
+        sleep(self.latency_secs)
+        FakeStreamManagerClient.streams[definition.name] = definition
+
+    def read_messages(self, stream_name, options=None):
+        sleep(options.read_timeout_millis / 1000)
+        raise NotEnoughMessagesException()
+
+    def append_message(self, stream_name, data):
+        sleep(self.latency_secs)
+        FakeStreamManagerClient.appended += 1
+        return FakeStreamManagerClient.appended
+
+    def close(self):
+        pass
+
+
+def run_configuration(engine, model_path, batch_size, iterations, publish_latency_secs, upload_latency_secs, infer_options, results):
+    r"""
+    Entry point of the benchmark process of one engine and batch size.
+
+    :param engine: name of the inference engine.
+    :param model_path: path of the model artifact.
+    :param batch_size: number of images per forward pass.
+    :param iterations: number of times the sample images are replayed.
+    :param publish_latency_secs: simulated latency of an IoT Core publish.
+    :param upload_latency_secs: simulated latency of a StreamManager call.
+    :param infer_options: keyword arguments of infer_batch.
+    :param results: queue to put the result dictionary to.
+    """
+    import config_utils
+    import IPCUtils as ipc_utils
+    from metrics import METRICS, LatencyHistogram
+    from model_manager import LOADERS, warm_up
+    from prediction_utils import load_images, predict_batch
+    from publisher import PUBLISHER
+    import uploader
+
+    ipc_client = FakeIPCClient(publish_latency_secs)
+    ipc_utils.get_ipc_client = lambda: ipc_client
+    FakeStreamManagerClient.latency_secs = upload_latency_secs
+    uploader.StreamManagerClient = FakeStreamManagerClient
+    config_utils.TOPIC = "benchmark/results"
+    # The component logs every prediction, which would dominate the timings
+    config_utils.logger.setLevel(logging.WARNING)
+
+    model = LOADERS[engine](model_path)
+    warm_up(model)
+    image_paths = [path.join(config_utils.IMAGE_DIR, image_name)
+                   for image_name in sorted(load_images(config_utils.IMAGE_DIR))] * iterations
+    METRICS.snapshot()
+
+    latencies = LatencyHistogram()
+    started = perf_counter()
+    for start in range(0, len(image_paths), batch_size):
+        batch_started = perf_counter()
+        predict_batch(image_paths[start:start + batch_size], model, batch_size, **infer_options)
+        latencies.record(perf_counter() - batch_started)
+    PUBLISHER.flush()
+    uploader.UPLOADER.flush()
+    elapsed = perf_counter() - started
+
+    results.put({
+        "engine": engine,
+        "batch_size": batch_size,
+        "frames": len(image_paths),
+        "throughput_fps": round(len(image_paths) / elapsed, 3),
+        "batch_latency": latencies.summary(),
+        "stages": METRICS.snapshot()["stages"],
+        "published_messages": ipc_client.messages,
+        "published_bytes": ipc_client.payload_bytes,
+        "uploads": FakeStreamManagerClient.appended,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    })
+
+
+def find_regressions(results, baseline, tolerance):
+    r"""
+    :param results: benchmark results.
+    :param baseline: results of an earlier run to compare against.
+    :param tolerance: accepted relative loss of throughput, for eg. 0.1 for 10%.
+    :return: messages describing the configurations whose throughput dropped by more than the tolerance.
+    """
+    baseline_throughputs = {(result["engine"], result["batch_size"]): result["throughput_fps"]
+                            for result in baseline}
+    regressions = []
+    for result in results:
+        expected = baseline_throughputs.get((result["engine"], result["batch_size"]))
+        if expected is not None and result["throughput_fps"] < expected * (1 - tolerance):
+            regressions.append("{} with batch size {}: {} frames/s, baseline {} frames/s".format(
+                result["engine"], result["batch_size"], result["throughput_fps"], expected))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="path of the ONNX model")
+    parser.add_argument("--engines", nargs="+", default=["onnxruntime"], help="inference engines to benchmark")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1], help="batch sizes to benchmark")
+    parser.add_argument("--images", default=path.join(COMPONENT_DIR, "sample_images"), help="directory of the images to replay")
+    parser.add_argument("--iterations", type=int, default=5, help="number of times the images are replayed")
+    parser.add_argument("--publish-latency-ms", type=float, default=0, help="simulated latency of an IoT Core publish")
+    parser.add_argument("--upload-latency-ms", type=float, default=0, help="simulated latency of a StreamManager call")
+    parser.add_argument("--tile-size", type=int, default=0, help="size of the tiles of tiled inference, 0 to disable it")
+    parser.add_argument("--tile-overlap", type=int, default=64, help="overlap of neighbouring tiles in pixels")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare the throughput against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="accepted relative loss of throughput against the baseline")
+    args = parser.parse_args()
+
+    # The component reads its paths from the environment Greengrass sets up
+    upload_dir = tempfile.mkdtemp(prefix="qualityinspection-benchmark-")
+    environ.setdefault("IMAGE_UPLOAD_BUCKET", "benchmark")
+    environ.setdefault("UPLOAD_DIR", upload_dir)
+    environ["IMAGE_DIR"] = args.images
+    environ.setdefault("INFERENCE_COMP_PATH", COMPONENT_DIR)
+    environ["MODEL_COMP_PATH"] = path.dirname(path.abspath(args.model))
+    environ["MODEL_NAME"] = path.basename(args.model)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for engine in args.engines:
+        for batch_size in args.batch_sizes:
+            queue = context.Queue()
+            process = context.Process(target=run_configuration, args=(
+                engine, path.abspath(args.model), batch_size, args.iterations,
+                args.publish_latency_ms / 1000, args.upload_latency_ms / 1000,
+                {"tile_size": args.tile_size, "tile_overlap": args.tile_overlap}, queue))
+            process.start()
+            result = None
+            while result is None and (process.is_alive() or not queue.empty()):
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    pass
+            process.join()
+            if result is None:
+                print("{} with batch size {} failed with exit code {}".format(engine, batch_size, process.exitcode))
+                sys.exit(1)
+            results.append(result)
+            print("{engine} batch size {batch_size}: {throughput_fps} frames/s, batch latency p50 {p50} ms p95 {p95} ms p99 {p99} ms, peak RSS {rss:.1f} MiB".format(
+                p50=result["batch_latency"]["p50_ms"], p95=result["batch_latency"]["p95_ms"], p99=result["batch_latency"]["p99_ms"],
+                rss=result["peak_rss_bytes"] / 2 ** 20, **result))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("Throughput regression: {}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+
+class Boxes:
+    r"""
+    Boxes of one image, with the attributes of Ultralytics boxes that get_box_details reads.
+    All coordinates are in pixels of the original image.
+    """
+
+    def __init__(self, xywh: np.ndarray, conf: np.ndarray, cls: np.ndarray):
+        self.xywh = xywh
+        self.conf = conf
+        self.cls = cls
+
+
+class Results:
+    r"""
+    Detection results of one image, in the shape of Ultralytics results.
+    """
+
+    def __init__(self, boxes: Boxes):
+        self.boxes = boxes
+
+
+def xywh_to_xyxy(boxes: np.ndarray) -> np.ndarray:
+    r"""
+    Converts boxes from center x, center y, width, height to top left and bottom right corners.
+
+    :param boxes: array of shape (n, 4).
+    :return: array of shape (n, 4).
+    """
+    xyxy = np.empty_like(boxes)
+    half_wh = boxes[:, 2:4] / 2
+    xyxy[:, 0:2] = boxes[:, 0:2] - half_wh
+    xyxy[:, 2:4] = boxes[:, 0:2] + half_wh
+    return xyxy
+
+
+def xyxy_to_xywh(boxes: np.ndarray) -> np.ndarray:
+    r"""
+    Converts boxes from top left and bottom right corners to center x, center y, width, height.
+
+    :param boxes: array of shape (n, 4).
+    :return: array of shape (n, 4).
+    """
+    xywh = np.empty_like(boxes)
+    xywh[:, 0:2] = (boxes[:, 0:2] + boxes[:, 2:4]) / 2
+    xywh[:, 2:4] = boxes[:, 2:4] - boxes[:, 0:2]
+    return xywh
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    r"""
+    Greedy non-maximum suppression. The overlaps of the best remaining box with all other remaining
+    boxes are computed in one vectorized step per kept box.
+
+    :param boxes: array of shape (n, 4) with top left and bottom right corners.
+    :param scores: array of shape (n,).
+    :param iou_threshold: boxes overlapping a better box by more than this intersection over union are dropped.
+    :return: indices of the kept boxes, ordered by descending score.
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[best] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
@@ -10,6 +10,8 @@ from awsiot.greengrasscoreipc.model import QOS
 dt = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
 
 SCORE_THRESHOLD = 0.7
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
 MAX_NO_OF_RESULTS = 5
 SHAPE = (300, 450)
 QOS_TYPE = QOS.AT_LEAST_ONCE
@@ -17,19 +19,89 @@ TIMEOUT = 10
 
 # Intialize all the variables with default values
 DEFAULT_PREDICTION_INTERVAL_SECS = 3600
-SCHEDULED_THREAD = None
+DEFAULT_FRAME_SOURCE = "random"
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_FRAME_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_INFERENCE_WORKERS = 0
+DEFAULT_PIPELINE_QUEUE_SIZE = 4
+DEFAULT_PIPELINE_BACKPRESSURE = "block"
+DEFAULT_TILE_SIZE = 0
+DEFAULT_TILE_OVERLAP = 64
+DEFAULT_DEDUP_MODE = "off"
+DEFAULT_DEDUP_MAX_DISTANCE = 4
+DEFAULT_DEDUP_HISTORY = 8
+DEFAULT_MAX_CPU_LOAD = 0.9
+DEFAULT_MAX_TEMPERATURE = 80
+RATE_CONTROL_INTERVAL_SECS = 5
+RATE_CONTROL_WINDOW = 10
+DEFAULT_INFERENCE_ENGINE = "ultralytics"
+ONNX_PROVIDERS = ["CPUExecutionProvider"]
+DEFAULT_MODEL_VARIANT = "fp32"
+MODEL_VARIANTS = ("fp32", "fp16", "int8", "int8-static")
+MODEL_BENCHMARK_RUNS = 10
+MODEL_CACHE_SIZE = 2
+MODEL_REFRESH_INTERVAL_SECS = 30
+WATCH_POLL_INTERVAL_SECS = 0.5
+STATS_LOG_INTERVAL_SECS = 60
+DEFAULT_METRICS_INTERVAL_SECS = 60
+DEFAULT_PUBLISH_BATCH_MAX_BYTES = 0
+DEFAULT_PUBLISH_BATCH_MAX_LATENCY_MS = 500
+# Leaves room for the envelope of the combined message below the IoT Core limit of 128 KB
+MAX_PUBLISH_BATCH_BYTES = 120 * 1024
+DEFAULT_LABELING_BUNDLE_MAX_BYTES = 0
+DEFAULT_LABELING_BUNDLE_MAX_AGE_SECS = 300
+DEFAULT_STAGING_MODE = "auto"
+DEFAULT_SAMPLER_STRATEGY = "off"
+DEFAULT_LABELING_BUDGET_PER_HOUR = 60
+DEFAULT_SAMPLER_MIN_CONFIDENCE = 0.25
+SAMPLER_MAX_CANDIDATES = 16
+DEFAULT_ANNOTATED_IMAGES = False
+DEFAULT_ANNOTATED_JPEG_QUALITY = 80
+DEFAULT_ANNOTATED_IMAGE_SCALE = 1.0
+DEFAULT_UPLOAD_MAX_DIMENSION = 0
+DEFAULT_UPLOAD_JPEG_QUALITY = 0
+DEFAULT_UPLOAD_GRAYSCALE = False
+DEFAULT_RESULT_STORE_MAX_BYTES = 0
+DEFAULT_RESULT_SHIP_BATCH_SIZE = 10
+RESULT_STORE_EVICT_ROWS = 100
+RESULT_SHIP_BACKOFF_SECS = 1
+RESULT_SHIP_MAX_BACKOFF_SECS = 60
+RESULT_SHIP_TIMEOUT_SECS = 30
+PUBLISH_MAX_IN_FLIGHT = 16
+PUBLISH_MAX_RETRIES = 3
+PUBLISH_RETRY_BACKOFF_SECS = 0.5
+METRICS_HISTOGRAM_PRECISION = 0.01
+INFERENCE_THREAD = None
+STOP_EVENT = None
 TOPIC = ""
+METRICS_TOPIC = ""
+METRICS_INTERVAL_SECS = DEFAULT_METRICS_INTERVAL_SECS
+PAYLOAD_ENCODINGS = {}
+STAGING_MODE = DEFAULT_STAGING_MODE
 
 condition = Condition()
 
 STREAM_NAME = "S3UploadStream"
+STATUS_STREAM_NAME = "S3UploadStatusStream"
+STATUS_STREAM_MAX_BYTES = 1024 * 1024
+STATUS_READ_BATCH_SIZE = 16
+STATUS_READ_TIMEOUT_MS = 1000
+UPLOAD_QUEUE_SIZE = 64
+UPLOAD_RETRY_BACKOFF_SECS = 1
+UPLOAD_MAX_RETRY_BACKOFF_SECS = 30
 UPLOAD_BUCKET_NAME = path.expandvars(environ.get("IMAGE_UPLOAD_BUCKET"))
 UPLOAD_BUCKET_LABELING_FOLDER = "pipeline/labeling/images/{}/".format(dt)
 UPLOAD_BUCKET_INFERENCE_FOLDER = "inference/{}/".format(dt)
 UPLOAD_DIR_INFERENCE = "{}/inference/{}/".format(path.expandvars(environ.get("UPLOAD_DIR")), dt)
 UPLOAD_DIR_LABELING = "{}/labeling/{}/".format(path.expandvars(environ.get("UPLOAD_DIR")), dt)
+UPLOAD_DIR_LABELING_BUNDLES = "{}/labeling-bundles/{}/".format(path.expandvars(environ.get("UPLOAD_DIR")), dt)
+STAGING_STORE_DIR = "{}/store/".format(path.expandvars(environ.get("UPLOAD_DIR")))
+# Not per start of the component, so that results stored before a restart are shipped after it
+RESULT_STORE_PATH = "{}/results.db".format(path.expandvars(environ.get("UPLOAD_DIR")))
 makedirs(UPLOAD_DIR_INFERENCE, exist_ok=True)
 makedirs(UPLOAD_DIR_LABELING, exist_ok=True)
+makedirs(UPLOAD_DIR_LABELING_BUNDLES, exist_ok=True)
+makedirs(STAGING_STORE_DIR, exist_ok=True)
 IMAGE_DIR = path.expandvars(environ.get("IMAGE_DIR"))
 INFERENCE_COMP_PATH = path.expandvars(environ.get("INFERENCE_COMP_PATH"))
 MODEL_COMP_PATH = path.expandvars(environ.get("MODEL_COMP_PATH"))
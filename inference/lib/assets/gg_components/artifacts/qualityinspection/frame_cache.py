@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import OrderedDict
+from os import stat
+from threading import Lock
+
+import config_utils
+import cv2
+from metrics import METRICS
+
+
+class FrameCache:
+    r"""
+    Least recently used cache of decoded frames, keyed by image path and modification time so that
+    an image which is overwritten on disk is decoded again. The cache is bounded by the total size
+    of the cached frames in bytes.
+
+    Cached frames are shared between callers and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes):
+        r"""
+        :param max_bytes: maximum total size of the cached frames. Frames are not cached if 0.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._keys = {}
+        self._bytes = 0
+        self._lock = Lock()
+
+    def get(self, image_path):
+        r"""
+        Returns the decoded frame of an image, decoding and caching it on a miss.
+
+        :param image_path: path of the image.
+        :return: the decoded frame as numpy array.
+        """
+        key = (image_path, stat(image_path).st_mtime_ns)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+
+        frame = cv2.imread(image_path)
+        if frame is None:
+            raise IOError("Unable to read the image at: {}".format(image_path))
+        self._put(key, frame)
+        return frame
+
+    def get_or_none(self, image_path):
+        r"""
+        Like get, but logs and counts an image which cannot be read, for eg. because it was deleted
+        or is truncated, so that one bad image does not fail the batch it is part of.
+
+        :param image_path: path of the image.
+        :return: the decoded frame as numpy array, or None if the image cannot be read.
+        """
+        try:
+            return self.get(image_path)
+        except OSError as e:
+            config_utils.logger.error("Skipping image {}: {}".format(image_path, e))
+            METRICS.count("decode_errors")
+            return None
+
+    def set_max_bytes(self, max_bytes):
+        r"""
+        Changes the size limit of the cache and evicts frames until the cache fits.
+
+        :param max_bytes: maximum total size of the cached frames.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _put(self, key, frame):
+        image_path = key[0]
+        with self._lock:
+            # Drop the frame of an older version of the same image
+            stale_key = self._keys.pop(image_path, None)
+            if stale_key is not None and stale_key in self._frames:
+                self._bytes -= self._frames.pop(stale_key).nbytes
+            if frame.nbytes > self.max_bytes:
+                return
+            self._frames[key] = frame
+            self._keys[image_path] = key
+            self._bytes += frame.nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            (image_path, _), frame = self._frames.popitem(last=False)
+            del self._keys[image_path]
+            self._bytes -= frame.nbytes
+
+
+FRAME_CACHE = FrameCache(config_utils.DEFAULT_FRAME_CACHE_MAX_BYTES)
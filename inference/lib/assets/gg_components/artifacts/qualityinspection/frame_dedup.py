@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import deque
+from threading import Lock
+
+import config_utils
+import cv2
+import numpy as np
+
+DEDUP_MODES = ("off", "reuse", "skip")
+HASH_SIZE = 8
+
+
+def difference_hash(image: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    r"""
+    Computes the perceptual difference hash of an image: the image is shrunk to
+    (hash_size + 1) x hash_size grayscale pixels and every bit tells whether a pixel is brighter
+    than its left neighbour. Frames which look alike have hashes with a small Hamming distance,
+    regardless of sensor noise and JPEG artifacts.
+
+    :param image: BGR, BGRA or grayscale image as numpy array.
+    :param hash_size: number of bits per row and column of the hash.
+    :return: the hash as integer of hash_size * hash_size bits.
+    """
+    # Shrinking first keeps the color conversion to a handful of pixels
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGRA2GRAY if small.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class HashEntry:
+    r"""
+    Hash of a frame which went through the model, and its box details once they are known.
+    """
+
+    def __init__(self, frame_hash: int):
+        self.frame_hash = frame_hash
+        self.boxes = None
+
+
+class FrameDeduplicator:
+    r"""
+    Remembers the hashes of the most recent frames which went through the model, so that frames
+    which are nearly the same as one of them can reuse its result or be skipped. Only frames which
+    went through the model are remembered, so a slowly changing scene is predicted again once it
+    drifted away from the last predicted frame.
+    """
+
+    def __init__(self, max_distance=config_utils.DEFAULT_DEDUP_MAX_DISTANCE,
+                 history=config_utils.DEFAULT_DEDUP_HISTORY):
+        r"""
+        :param max_distance: maximum number of differing hash bits of two frames considered the same.
+        :param history: number of recent hashes to compare against.
+        """
+        self.max_distance = max_distance
+        self._entries = deque(maxlen=max(1, history))
+        self._lock = Lock()
+
+    def match(self, frame_hash: int):
+        r"""
+        :param frame_hash: difference hash of a frame.
+        :return: the HashEntry of the most recent frame within the maximum distance, or None.
+        """
+        with self._lock:
+            for entry in reversed(self._entries):
+                if bin(entry.frame_hash ^ frame_hash).count("1") <= self.max_distance:
+                    return entry
+        return None
+
+    def remember(self, frame_hash: int) -> HashEntry:
+        r"""
+        :param frame_hash: difference hash of a frame which goes through the model.
+        :return: the HashEntry to set the box details of once they are known.
+        """
+        entry = HashEntry(frame_hash)
+        with self._lock:
+            self._entries.append(entry)
+        return entry
@@ -0,0 +1,229 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import random
+from glob import glob
+from os import listdir, path, stat
+from time import monotonic
+
+import config_utils
+import cv2
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg')
+
+
+def random_replay(image_dir, image_names):
+    r"""
+    Yields randomly picked images of the image directory forever.
+
+    :param image_dir: path of the image dir on the device.
+    :param image_names: names of the images to pick from.
+    :return: a generator of (image_path, None) tuples. The image is decoded by the consumer.
+    """
+    while True:
+        yield path.join(image_dir, random.choice(image_names)), None
+
+
+def glob_replay(pattern, loop=True):
+    r"""
+    Yields the images matching a glob pattern in sorted order.
+
+    :param pattern: glob pattern of the images to replay, for eg. /data/line1/*.jpg
+    :param loop: restarts from the first image when all images were replayed.
+    :return: a generator of (image_path, None) tuples. The image is decoded by the consumer.
+    """
+    image_paths = sorted(glob(pattern))
+    if not image_paths:
+        config_utils.logger.error(
+            "No images found matching pattern: {}".format(pattern))
+        return
+    while True:
+        for image_path in image_paths:
+            yield image_path, None
+        if not loop:
+            return
+
+
+def watch_directory(image_dir, stop_event, poll_interval_secs=config_utils.WATCH_POLL_INTERVAL_SECS):
+    r"""
+    Yields images as they are written to the image directory. Images already present when the
+    watcher starts are not yielded. A new image is only yielded once its size and modification
+    time are the same in two listings, so that images the camera is still writing are not read.
+
+    :param image_dir: path of the image dir on the device.
+    :param stop_event: event which ends the generator when set.
+    :param poll_interval_secs: seconds to wait before listing the directory again if nothing new arrived.
+    :return: a generator of (image_path, None) tuples. The image is decoded by the consumer.
+    """
+    seen = set(listdir(image_dir))
+    # Size and modification time of the new images at the previous listing, by name
+    writing = {}
+    while not stop_event.is_set():
+        names = set(listdir(image_dir))
+        new_images = []
+        for name in sorted(names - seen):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                seen.add(name)
+                continue
+            try:
+                file_stat = stat(path.join(image_dir, name))
+            except FileNotFoundError:
+                continue
+            signature = (file_stat.st_size, file_stat.st_mtime_ns)
+            if file_stat.st_size > 0 and writing.get(name) == signature:
+                new_images.append(name)
+                seen.add(name)
+                del writing[name]
+            else:
+                writing[name] = signature
+        # Forget deleted files so that the sets do not grow without bounds
+        seen &= names
+        writing = {name: signature for name, signature in writing.items() if name in names}
+        for name in new_images:
+            yield path.join(image_dir, name), None
+        if not new_images:
+            stop_event.wait(poll_interval_secs)
+
+
+def video_frames(video_path, loop=False):
+    r"""
+    Yields the decoded frames of a video file.
+
+    :param video_path: path of the video file on the device.
+    :param loop: restarts from the first frame when the end of the video is reached.
+    :return: a generator of (frame_path, frame) tuples. The frame path is synthetic and only used for naming.
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        config_utils.logger.error(
+            "Unable to open the video at: {}".format(video_path))
+        return
+    video_dir = path.dirname(video_path)
+    stem = path.splitext(path.basename(video_path))[0]
+    index = 0
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                if not loop or index == 0:
+                    return
+                capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                index = 0
+                continue
+            yield path.join(video_dir, "{}-{:08d}.jpg".format(stem, index)), frame
+            index += 1
+    finally:
+        capture.release()
+
+
+class StreamStats:
+    r"""
+    Counts the frames processed by the streaming loop and the deadlines it missed.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.deadline_misses = 0
+        self.started = monotonic()
+        self._last_report = self.started
+        self._last_report_frames = 0
+
+    def record(self, frames=1):
+        self.frames += frames
+
+    def report_if_due(self, interval_secs=config_utils.STATS_LOG_INTERVAL_SECS):
+        now = monotonic()
+        if now - self._last_report < interval_secs:
+            return
+        throughput = (self.frames - self._last_report_frames) / \
+            (now - self._last_report)
+        config_utils.logger.info(
+            "Streaming inference: {:.2f} frames/s over the last {:.0f}s, {} frames and {} missed deadlines in total".format(
+                throughput, now - self._last_report, self.frames, self.deadline_misses))
+        self._last_report = now
+        self._last_report_frames = self.frames
+
+
+class Pacer:
+    r"""
+    Releases frames at a fixed rate. Deadlines are derived from the previous deadline rather than
+    from the time the previous frame finished, so the rate does not drift with the inference time.
+    If the loop falls behind by more than a period, the missed deadlines are counted and skipped
+    instead of being caught up in a burst.
+    """
+
+    def __init__(self, period_secs, stop_event, stats):
+        r"""
+        :param period_secs: seconds between two frames. Frames are released as fast as possible if not positive.
+        :param stop_event: event which interrupts the wait when set.
+        :param stats: StreamStats object to count missed deadlines in.
+        """
+        self.period_secs = period_secs
+        self._stop_event = stop_event
+        self._stats = stats
+        self._next_deadline = None
+
+    def set_period(self, period_secs):
+        r"""
+        Changes the rate. The next deadline moves with the period, so a shorter period takes
+        effect with the next frame.
+
+        :param period_secs: seconds between two frames.
+        """
+        if self._next_deadline is not None and self.period_secs > 0:
+            self._next_deadline += period_secs - self.period_secs
+        self.period_secs = period_secs
+
+    def wait(self):
+        r"""
+        Blocks until the next frame is due.
+
+        :return: False if the stop event was set while waiting, True otherwise.
+        """
+        if self.period_secs <= 0:
+            return not self._stop_event.is_set()
+        now = monotonic()
+        if self._next_deadline is None:
+            self._next_deadline = now
+        delay = self._next_deadline - now
+        if delay > 0:
+            if self._stop_event.wait(delay):
+                return False
+        elif -delay >= self.period_secs:
+            self._stats.deadline_misses += int(-delay // self.period_secs)
+            self._next_deadline = now
+        self._next_deadline += self.period_secs
+        return not self._stop_event.is_set()
+
+
+def paced(frames, pacer):
+    r"""
+    Releases the frames of a frame source at the rate of the pacer.
+
+    :param frames: a frame source generator.
+    :param pacer: Pacer object.
+    :return: a generator of the frames of the frame source.
+    """
+    for frame in frames:
+        if not pacer.wait():
+            return
+        yield frame
+
+
+def batched(frames, batch_size):
+    r"""
+    Groups the frames of a frame source into lists of batch_size frames. The last list is shorter
+    if the frame source ends.
+
+    :param frames: a frame source generator.
+    :param batch_size: number of frames per list.
+    :return: a generator of lists of frames.
+    """
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
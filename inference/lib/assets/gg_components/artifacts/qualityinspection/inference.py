@@ -1,14 +1,33 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-from os import path
-from threading import Thread, Timer
-from time import sleep
-import random
+import json
+import signal
+from os import _exit, path, remove
+from threading import Event, Thread
 import config_utils
 import IPCUtils as ipc_utils
-from prediction_utils import load_images, predict
-from ultralytics import YOLO
+from active_learning import ActiveLearningSampler
+from frame_sources import (Pacer, StreamStats, batched, glob_replay, paced,
+                           random_replay, video_frames, watch_directory)
+from frame_cache import FRAME_CACHE
+from frame_dedup import DEDUP_MODES, FrameDeduplicator, difference_hash
+from label_bundler import LabelBundler
+from metrics import METRICS
+from model_manager import MODEL_MANAGER
+from payload_codec import ENCODINGS
+from pipeline import Pipeline, Stage
+from prediction_utils import (generate_bounding_box_image, infer_batch,
+                              load_images, publish_prediction,
+                              upload_for_labeling)
+from publisher import PUBLISHER
+from rate_controller import RateController
+from result_batcher import ResultBatcher
+from result_store import ResultShipper, ResultStore
+from staging import STAGING_MODES, prune_store, release
+from upload_transform import UploadTransform
+from uploader import UPLOADER
+from worker_pool import WorkerPool
 
 
 def set_configuration(config):
@@ -41,6 +60,153 @@ def set_configuration(config):
             )
         )
 
+    if "FrameSource" in config:
+        new_config["frame_source"] = config["FrameSource"]
+    else:
+        new_config["frame_source"] = config_utils.DEFAULT_FRAME_SOURCE
+    config_utils.logger.info(
+        "Using frame source: {}".format(new_config["frame_source"]))
+
+    if "FrameSourcePath" in config:
+        new_config["frame_source_path"] = config["FrameSourcePath"]
+    else:
+        new_config["frame_source_path"] = new_config["image_dir"]
+
+    if "TargetFps" in config:
+        target_fps = float(config["TargetFps"])
+        new_config["frame_period_secs"] = 1 / target_fps if target_fps > 0 else 0
+        config_utils.logger.info(
+            "Setting target frame rate: {}".format(target_fps))
+    else:
+        new_config["frame_period_secs"] = float(
+            new_config["prediction_interval_secs"])
+
+    if "AdaptiveRate" in config:
+        new_config["adaptive_rate"] = str(config["AdaptiveRate"]).lower() == "true"
+    else:
+        new_config["adaptive_rate"] = False
+
+    if "MinInferenceInterval" in config:
+        new_config["min_period_secs"] = float(config["MinInferenceInterval"])
+    else:
+        new_config["min_period_secs"] = new_config["frame_period_secs"] / 4
+
+    if "MaxInferenceInterval" in config:
+        new_config["max_period_secs"] = float(config["MaxInferenceInterval"])
+    else:
+        new_config["max_period_secs"] = new_config["frame_period_secs"] * 4
+
+    if "MaxCpuLoad" in config:
+        new_config["max_cpu_load"] = float(config["MaxCpuLoad"])
+    else:
+        new_config["max_cpu_load"] = config_utils.DEFAULT_MAX_CPU_LOAD
+
+    if "MaxTemperature" in config:
+        new_config["max_temperature"] = float(config["MaxTemperature"])
+    else:
+        new_config["max_temperature"] = config_utils.DEFAULT_MAX_TEMPERATURE
+
+    if "BatchSize" in config:
+        new_config["batch_size"] = int(config["BatchSize"])
+        config_utils.logger.info(
+            "Setting batch size: {}".format(new_config["batch_size"]))
+    else:
+        new_config["batch_size"] = config_utils.DEFAULT_BATCH_SIZE
+
+    if "FrameCacheMaxBytes" in config:
+        FRAME_CACHE.set_max_bytes(int(config["FrameCacheMaxBytes"]))
+        config_utils.logger.info(
+            "Setting frame cache size: {} bytes".format(FRAME_CACHE.max_bytes))
+    else:
+        FRAME_CACHE.set_max_bytes(config_utils.DEFAULT_FRAME_CACHE_MAX_BYTES)
+
+    if "InferenceWorkers" in config:
+        new_config["inference_workers"] = int(config["InferenceWorkers"])
+        config_utils.logger.info(
+            "Setting inference workers: {}".format(new_config["inference_workers"]))
+    else:
+        new_config["inference_workers"] = config_utils.DEFAULT_INFERENCE_WORKERS
+
+    new_config["infer_options"] = {}
+    if "TileSize" in config:
+        new_config["infer_options"]["tile_size"] = int(config["TileSize"])
+        config_utils.logger.info(
+            "Setting tile size: {}".format(new_config["infer_options"]["tile_size"]))
+    else:
+        new_config["infer_options"]["tile_size"] = config_utils.DEFAULT_TILE_SIZE
+
+    if "TileOverlap" in config:
+        new_config["infer_options"]["tile_overlap"] = int(config["TileOverlap"])
+    else:
+        new_config["infer_options"]["tile_overlap"] = config_utils.DEFAULT_TILE_OVERLAP
+
+    if "RegionsOfInterest" in config:
+        regions_of_interest = config["RegionsOfInterest"]
+        if isinstance(regions_of_interest, str):
+            regions_of_interest = json.loads(regions_of_interest)
+        new_config["infer_options"]["regions_of_interest"] = regions_of_interest
+        config_utils.logger.info(
+            "Setting regions of interest: {}".format(regions_of_interest))
+    else:
+        new_config["infer_options"]["regions_of_interest"] = None
+
+    if "LabelingSampler" in config:
+        new_config["labeling_sampler"] = config["LabelingSampler"]
+        config_utils.logger.info(
+            "Sampling frames for labeling by {}".format(new_config["labeling_sampler"]))
+    else:
+        new_config["labeling_sampler"] = config_utils.DEFAULT_SAMPLER_STRATEGY
+
+    if "LabelingBudget" in config:
+        new_config["labeling_budget_per_hour"] = float(config["LabelingBudget"])
+    else:
+        new_config["labeling_budget_per_hour"] = config_utils.DEFAULT_LABELING_BUDGET_PER_HOUR
+
+    if "SamplerMinConfidence" in config:
+        new_config["sampler_min_confidence"] = float(config["SamplerMinConfidence"])
+    else:
+        new_config["sampler_min_confidence"] = config_utils.DEFAULT_SAMPLER_MIN_CONFIDENCE
+
+    if new_config["labeling_sampler"] != "off":
+        # The sampler scores boxes below the score threshold too
+        new_config["infer_options"]["min_confidence"] = new_config["sampler_min_confidence"]
+
+    if "DedupMode" in config:
+        new_config["dedup_mode"] = config["DedupMode"]
+        config_utils.logger.info(
+            "Using duplicate frame suppression mode: {}".format(new_config["dedup_mode"]))
+    else:
+        new_config["dedup_mode"] = config_utils.DEFAULT_DEDUP_MODE
+
+    if "DedupMaxDistance" in config:
+        new_config["dedup_max_distance"] = int(config["DedupMaxDistance"])
+    else:
+        new_config["dedup_max_distance"] = config_utils.DEFAULT_DEDUP_MAX_DISTANCE
+
+    if "DedupHistory" in config:
+        new_config["dedup_history"] = int(config["DedupHistory"])
+    else:
+        new_config["dedup_history"] = config_utils.DEFAULT_DEDUP_HISTORY
+
+    if "PipelineQueueSize" in config:
+        new_config["pipeline_queue_size"] = int(config["PipelineQueueSize"])
+    else:
+        new_config["pipeline_queue_size"] = config_utils.DEFAULT_PIPELINE_QUEUE_SIZE
+
+    if "PipelineBackpressure" in config:
+        new_config["pipeline_backpressure"] = config["PipelineBackpressure"]
+    else:
+        new_config["pipeline_backpressure"] = config_utils.DEFAULT_PIPELINE_BACKPRESSURE
+    if "MaxQueueDepth" in config:
+        new_config["max_queue_depth"] = int(config["MaxQueueDepth"])
+    else:
+        # Half full queues mean the stages do not keep up with the frame rate
+        new_config["max_queue_depth"] = 2 * new_config["pipeline_queue_size"]
+
+    config_utils.logger.info(
+        "Using pipeline queues of {} items with backpressure policy {}".format(
+            new_config["pipeline_queue_size"], new_config["pipeline_backpressure"]))
+
     if "PublishResultsOnTopic" in config:
         config_utils.TOPIC = config["PublishResultsOnTopic"]
     else:
@@ -48,48 +214,422 @@ def set_configuration(config):
         config_utils.logger.info(
             "Topic to publish inference results is empty.")
 
-    new_config["images"] = load_images(new_config["image_dir"])
-    model = YOLO(
-        f"{config_utils.MODEL_COMP_PATH}/{config_utils.MODEL_NAME}", task='detect')
-    
+    if "PublishMetricsOnTopic" in config:
+        config_utils.METRICS_TOPIC = config["PublishMetricsOnTopic"]
+    else:
+        config_utils.METRICS_TOPIC = ""
+        config_utils.logger.info(
+            "Topic to publish metrics is empty, metrics are only logged.")
+
+    if "MetricsInterval" in config:
+        config_utils.METRICS_INTERVAL_SECS = float(config["MetricsInterval"])
+    else:
+        config_utils.METRICS_INTERVAL_SECS = config_utils.DEFAULT_METRICS_INTERVAL_SECS
 
-    # Run inference with the updated config indicating the config change.
-    run_inference(new_config, True,model)
+    if "PublishBatchMaxBytes" in config:
+        new_config["publish_batch_max_bytes"] = min(
+            int(config["PublishBatchMaxBytes"]), config_utils.MAX_PUBLISH_BATCH_BYTES)
+    else:
+        new_config["publish_batch_max_bytes"] = config_utils.DEFAULT_PUBLISH_BATCH_MAX_BYTES
+
+    if "PublishBatchMaxLatency" in config:
+        new_config["publish_batch_max_latency_secs"] = int(config["PublishBatchMaxLatency"]) / 1000
+    else:
+        new_config["publish_batch_max_latency_secs"] = config_utils.DEFAULT_PUBLISH_BATCH_MAX_LATENCY_MS / 1000
+
+    if new_config["publish_batch_max_bytes"] > 0:
+        config_utils.logger.info(
+            "Publishing results in batches of up to {} bytes or {}s".format(
+                new_config["publish_batch_max_bytes"], new_config["publish_batch_max_latency_secs"]))
+
+    if "LabelingBundleMaxBytes" in config:
+        new_config["labeling_bundle_max_bytes"] = int(config["LabelingBundleMaxBytes"])
+    else:
+        new_config["labeling_bundle_max_bytes"] = config_utils.DEFAULT_LABELING_BUNDLE_MAX_BYTES
+
+    if "LabelingBundleMaxAge" in config:
+        new_config["labeling_bundle_max_age_secs"] = float(config["LabelingBundleMaxAge"])
+    else:
+        new_config["labeling_bundle_max_age_secs"] = config_utils.DEFAULT_LABELING_BUNDLE_MAX_AGE_SECS
+
+    if new_config["labeling_bundle_max_bytes"] > 0:
+        config_utils.logger.info(
+            "Uploading images for labeling in bundles of up to {} bytes or {}s".format(
+                new_config["labeling_bundle_max_bytes"], new_config["labeling_bundle_max_age_secs"]))
+
+    if "StagingMode" in config:
+        if config["StagingMode"] in STAGING_MODES:
+            config_utils.STAGING_MODE = config["StagingMode"]
+        else:
+            config_utils.logger.error(
+                "Unknown staging mode: {}, using {}".format(config["StagingMode"], config_utils.DEFAULT_STAGING_MODE))
+            config_utils.STAGING_MODE = config_utils.DEFAULT_STAGING_MODE
+    else:
+        config_utils.STAGING_MODE = config_utils.DEFAULT_STAGING_MODE
+
+    if "AnnotatedImages" in config:
+        new_config["annotated_images"] = str(config["AnnotatedImages"]).lower() == "true"
+    else:
+        new_config["annotated_images"] = config_utils.DEFAULT_ANNOTATED_IMAGES
+
+    if "AnnotatedJpegQuality" in config:
+        new_config["annotated_jpeg_quality"] = int(config["AnnotatedJpegQuality"])
+    else:
+        new_config["annotated_jpeg_quality"] = config_utils.DEFAULT_ANNOTATED_JPEG_QUALITY
+
+    if "AnnotatedImageScale" in config:
+        new_config["annotated_image_scale"] = float(config["AnnotatedImageScale"])
+    else:
+        new_config["annotated_image_scale"] = config_utils.DEFAULT_ANNOTATED_IMAGE_SCALE
 
-def run_inference(new_config, config_changed,model:YOLO):
+    if "UploadMaxDimension" in config:
+        upload_max_dimension = int(config["UploadMaxDimension"])
+    else:
+        upload_max_dimension = config_utils.DEFAULT_UPLOAD_MAX_DIMENSION
+
+    if "UploadJpegQuality" in config:
+        upload_jpeg_quality = int(config["UploadJpegQuality"])
+    else:
+        upload_jpeg_quality = config_utils.DEFAULT_UPLOAD_JPEG_QUALITY
+
+    if "UploadGrayscale" in config:
+        upload_grayscale = str(config["UploadGrayscale"]).lower() == "true"
+    else:
+        upload_grayscale = config_utils.DEFAULT_UPLOAD_GRAYSCALE
+
+    if "UploadRegionOfInterest" in config:
+        upload_region = config["UploadRegionOfInterest"]
+        if isinstance(upload_region, str):
+            upload_region = json.loads(upload_region)
+    else:
+        upload_region = None
+
+    new_config["upload_transform"] = UploadTransform(
+        upload_max_dimension, upload_jpeg_quality, upload_grayscale, upload_region)
+    if new_config["upload_transform"].enabled():
+        config_utils.logger.info(
+            "Re-encoding images for labeling with a maximum dimension of {}, JPEG quality {}, grayscale {} and region {}".format(
+                upload_max_dimension, upload_jpeg_quality, upload_grayscale, upload_region))
+
+    if "ResultStoreMaxBytes" in config:
+        new_config["result_store_max_bytes"] = int(config["ResultStoreMaxBytes"])
+    else:
+        new_config["result_store_max_bytes"] = config_utils.DEFAULT_RESULT_STORE_MAX_BYTES
+
+    if "ResultShipBatchSize" in config:
+        new_config["result_ship_batch_size"] = int(config["ResultShipBatchSize"])
+    else:
+        new_config["result_ship_batch_size"] = config_utils.DEFAULT_RESULT_SHIP_BATCH_SIZE
+
+    if new_config["result_store_max_bytes"] > 0:
+        config_utils.logger.info(
+            "Storing results in {} up to {} bytes before publishing them".format(
+                config_utils.RESULT_STORE_PATH, new_config["result_store_max_bytes"]))
+
+    if "PayloadEncodings" in config:
+        payload_encodings = config["PayloadEncodings"]
+        if isinstance(payload_encodings, str):
+            payload_encodings = json.loads(payload_encodings)
+        for topic, encoding in list(payload_encodings.items()):
+            if encoding not in ENCODINGS:
+                config_utils.logger.error(
+                    "Unknown payload encoding of topic {}: {}, using json".format(topic, encoding))
+                del payload_encodings[topic]
+        config_utils.PAYLOAD_ENCODINGS = payload_encodings
+        config_utils.logger.info(
+            "Using payload encodings: {}".format(payload_encodings))
+    else:
+        config_utils.PAYLOAD_ENCODINGS = {}
+
+    if new_config["frame_source"] == "random":
+        new_config["images"] = load_images(new_config["image_dir"])
+    if "InferenceEngine" in config:
+        new_config["inference_engine"] = config["InferenceEngine"]
+    else:
+        new_config["inference_engine"] = config_utils.DEFAULT_INFERENCE_ENGINE
+    config_utils.logger.info(
+        "Using inference engine: {}".format(new_config["inference_engine"]))
+
+    if "ModelVariant" in config:
+        new_config["model_variant"] = config["ModelVariant"]
+    else:
+        new_config["model_variant"] = config_utils.DEFAULT_MODEL_VARIANT
+    config_utils.logger.info(
+        "Using model variant: {}".format(new_config["model_variant"]))
+
+    # Only loads the model if the engine or the model artifact changed since the last configuration.
+    model_path = MODEL_MANAGER.select_variant(
+        config_utils.MODEL_COMP_PATH, config_utils.MODEL_NAME, new_config["model_variant"], new_config["inference_engine"])
+    MODEL_MANAGER.load(model_path, new_config["inference_engine"])
+
+    # Restart the inference loop with the updated config.
+    run_inference(new_config)
+
+
+def create_frame_source(new_config, stop_event):
     r"""
-    Uses the new config to run inference.
+    Creates the frame source generator selected by the FrameSource configuration.
+
+    :param new_config: Updated config.
+    :param stop_event: Event which ends the frame source when set.
+    :return: a generator of (image_path, image) tuples.
+    """
+    frame_source = new_config["frame_source"]
+    source_path = new_config["frame_source_path"]
+    if frame_source == "random":
+        return random_replay(new_config["image_dir"], new_config["images"])
+    if frame_source == "replay":
+        if path.isdir(source_path):
+            source_path = path.join(source_path, "*.jpg")
+        return glob_replay(source_path)
+    if frame_source == "watch":
+        return watch_directory(source_path, stop_event)
+    if frame_source == "video":
+        return video_frames(source_path, loop=True)
+    raise ValueError("Unknown frame source: {}".format(frame_source))
+
+
+def run_inference(new_config):
+    r"""
+    Stops the running inference loop, if any, and starts a new one with the new config.
+
+    :param new_config: Updated config.
+    """
+    if config_utils.INFERENCE_THREAD is not None:
+        config_utils.STOP_EVENT.set()
+        config_utils.INFERENCE_THREAD.join()
+
+    config_utils.STOP_EVENT = Event()
+    config_utils.INFERENCE_THREAD = Thread(
+        target=stream_inference,
+        args=(new_config, config_utils.STOP_EVENT),
+    )
+    config_utils.INFERENCE_THREAD.start()
+
+
+def stream_inference(new_config, stop_event):
+    r"""
+    Runs inference on the frames of the configured frame source until the stop event is set.
+    Frames are released at the configured rate, or as fast as the device allows if the rate is 0,
+    and are predicted in batches of the configured batch size. The current model of the model
+    manager is looked up per batch, so a swapped model is picked up without restarting the loop.
+
+    Batches are handed to a pipeline of decode, infer, publish, label and annotate stages, so
+    publishing and uploading do not add to the inference latency.
 
-    :param new_config: Updated config if the config changed. Else, the last updated config.
-    :param config_changed: Is True when run_inference is called after setting the newly updated config.
-    Is False if run_inference is called using scheduled thread as the config hasn't changed.
+    :param new_config: Updated config.
+    :param stop_event: Event which ends the loop when set.
     """
-    if config_changed:
-        if config_utils.SCHEDULED_THREAD is not None:
-            config_utils.SCHEDULED_THREAD.cancel()
-        config_changed = False
+    stats = StreamStats()
+    pacer = Pacer(new_config["frame_period_secs"], stop_event, stats)
+    config_utils.logger.info(
+        "Starting inference loop with a frame period of {}s".format(pacer.period_secs))
+    controller = None
+    if new_config["adaptive_rate"] and pacer.period_secs > 0:
+        controller = RateController(
+            pacer.period_secs, new_config["min_period_secs"], new_config["max_period_secs"],
+            new_config["max_cpu_load"], new_config["max_temperature"], new_config["max_queue_depth"],
+            lambda: pipeline.queue_depth())
+        METRICS.set_gauge("inference_period_secs", lambda: controller.period_secs)
     try:
-        # pick random image from list and predict
-        config_utils.logger.info(
-            f"Images array {new_config['images'].keys()}")
-        
-        image = random.choice(list(new_config["images"].keys()))
-        config_utils.logger.info(
-            f"NOW PREDICTING from image {path.join(new_config['image_dir'], image)}")
-        predict( image, model)
+        frames = create_frame_source(new_config, stop_event)
+        pipeline = create_pipeline(new_config, controller.observe if controller is not None else None)
     except Exception as e:
         config_utils.logger.exception(
-            "Error running the inference: {}".format(
-                e)
-        )
+            "Error creating the inference loop: {}".format(e))
+        return
 
-    config_utils.logger.info(f'Scheduling inference with interval: {new_config["prediction_interval_secs"]}')
-    config_utils.SCHEDULED_THREAD = Timer(
-        int(new_config["prediction_interval_secs"]),
-        run_inference,
-        [new_config, config_changed,model],
-    )
-    config_utils.SCHEDULED_THREAD.start()
+    for batch in batched(paced(frames, pacer), new_config["batch_size"]):
+        pipeline.put(batch)
+        METRICS.count("frames", len(batch))
+        stats.record(len(batch))
+        stats.report_if_due()
+        if controller is not None:
+            pacer.set_period(controller.update())
+    frames.close()
+    pipeline.close()
+    PUBLISHER.flush()
+    if controller is not None:
+        METRICS.set_gauge("inference_period_secs", None)
+    config_utils.logger.info("Inference loop stopped")
+
+
+def create_pipeline(new_config, observe_result=None):
+    r"""
+    Creates the stages of the inference loop:
+    decode takes frames from the frame cache, infer runs the model, publish sends the boxes to
+    IoT Core and label uploads the frames without boxes to S3. With inference workers, frames are
+    decoded and predicted by the worker pool, which hands its results to the publish stage. With
+    a publish batch budget, the publish stage hands the results to a ResultBatcher instead, and
+    with a labeling bundle budget, the label stage collects the frames into a LabelBundler.
+    With annotated images, the publish stage also hands the frames with boxes to annotate, which
+    draws the boxes on the decoded frame and uploads it to S3.
+    With a result store, results are stored first and a ResultShipper publishes them. With a
+    labeling sampler, the frames to label are chosen by the uncertainty of the model instead of
+    being the frames without boxes. With an upload transform, label re-encodes the frames before
+    they are staged or bundled.
+
+    With duplicate suppression, decode also hashes every frame. Frames which are nearly the same
+    as a recently predicted frame do not go through the model. They are either skipped or publish
+    the boxes of that frame again, and are never uploaded for labeling.
+
+    :param new_config: Updated config.
+    :param observe_result: optional function called with the box details of every predicted frame, for eg. by the rate controller.
+    :return: the started Pipeline, which takes lists of (image_path, image) tuples.
+    """
+    num_workers = new_config["inference_workers"]
+    dedup_mode = new_config["dedup_mode"]
+    if dedup_mode not in DEDUP_MODES:
+        raise ValueError("Unknown duplicate suppression mode: {}".format(dedup_mode))
+    deduplicator = FrameDeduplicator(new_config["dedup_max_distance"], new_config["dedup_history"])
+    workers = {"pool": None}
+
+    def decode(batch):
+        image_paths, images, entries = [], [], []
+        for image_path, image in batch:
+            if image is None and (num_workers == 0 or dedup_mode != "off"):
+                image = FRAME_CACHE.get_or_none(image_path)
+                if image is None:
+                    continue
+            entry = None
+            if dedup_mode != "off":
+                frame_hash = difference_hash(image)
+                match = deduplicator.match(frame_hash)
+                if match is not None:
+                    METRICS.count("duplicates")
+                    # The matched frame may still be in flight, in which case its own result is published
+                    if dedup_mode == "reuse" and match.boxes is not None:
+                        pipeline.put((image_path, image, match.boxes, True), "publish")
+                    continue
+                entry = deduplicator.remember(frame_hash)
+            image_paths.append(image_path)
+            images.append(image)
+            entries.append(entry)
+        if not image_paths:
+            return []
+        return [(image_paths, images, entries)]
+
+    def handle_result(image_path, image, boxes, entry):
+        if entry is not None:
+            entry.boxes = boxes
+        pipeline.put((image_path, image, boxes, False), "publish")
+
+    def infer(item):
+        image_paths, images, entries = item
+        config_utils.logger.info(f"NOW PREDICTING from images {image_paths}")
+        if num_workers > 0:
+            workers["pool"] = refresh_worker_pool(
+                workers["pool"], num_workers, handle_result, new_config["infer_options"])
+            workers["pool"].submit(image_paths, images, entries)
+            return []
+        boxes = infer_batch(images, MODEL_MANAGER.get(), image_paths, **new_config["infer_options"])
+        for entry, image_boxes in zip(entries, boxes):
+            if entry is not None:
+                entry.boxes = image_boxes
+        return [(image_path, image, image_boxes, False)
+                for image_path, image, image_boxes in zip(image_paths, images, boxes)]
+
+    def close_workers():
+        if workers["pool"] is not None:
+            workers["pool"].close()
+
+    store, shipper = None, None
+    publish_result = PUBLISHER.publish_async
+    if new_config["result_store_max_bytes"] > 0:
+        store = ResultStore(config_utils.RESULT_STORE_PATH, new_config["result_store_max_bytes"])
+        shipper = ResultShipper(store, PUBLISHER.publish_async, new_config["result_ship_batch_size"])
+        publish_result = store.append
+        METRICS.set_gauge("results_stored", store.count)
+
+    batcher = None
+    if new_config["publish_batch_max_bytes"] > 0:
+        batcher = ResultBatcher(
+            publish_result,
+            new_config["publish_batch_max_bytes"], new_config["publish_batch_max_latency_secs"],
+            config_utils.PAYLOAD_ENCODINGS.get(config_utils.TOPIC, "json"))
+
+    sampler = None
+    if new_config["labeling_sampler"] != "off":
+        sampler = ActiveLearningSampler(
+            new_config["labeling_sampler"], new_config["labeling_budget_per_hour"],
+            new_config["sampler_min_confidence"])
+
+    def publish(item):
+        image_path, image, boxes, duplicate = item
+        if observe_result is not None and not duplicate:
+            observe_result(boxes)
+        published = publish_prediction(image_path, boxes, batcher.add if batcher is not None else publish_result)
+        if duplicate:
+            return []
+        if published and new_config["annotated_images"]:
+            pipeline.put((image_path, image, boxes), "annotate")
+        if sampler is not None:
+            return sampler.offer(image_path, image, boxes)
+        if published:
+            return []
+        return [(image_path, image)]
+
+    def close_publishing():
+        if batcher is not None:
+            batcher.close()
+        if shipper is not None:
+            shipper.close()
+            METRICS.set_gauge("results_stored", None)
+            store.close()
+
+    bundler = None
+    if new_config["labeling_bundle_max_bytes"] > 0:
+        bundler = LabelBundler(
+            lambda bundle_path: UPLOADER.upload(bundle_path, config_utils.UPLOAD_BUCKET_LABELING_FOLDER,
+                                                on_exported=remove),
+            config_utils.UPLOAD_DIR_LABELING_BUNDLES, new_config["labeling_bundle_max_bytes"],
+            new_config["labeling_bundle_max_age_secs"], new_config["upload_transform"])
+
+    def label(item):
+        if bundler is not None:
+            bundler.add(*item)
+        else:
+            upload_for_labeling(*item, new_config["upload_transform"])
+
+    def annotate(item):
+        image_path, image, boxes = item
+        if image is None:
+            image = FRAME_CACHE.get(image_path)
+        annotated_path = generate_bounding_box_image(
+            image_path, image, boxes, new_config["annotated_jpeg_quality"], new_config["annotated_image_scale"])
+        UPLOADER.upload(annotated_path, config_utils.UPLOAD_BUCKET_INFERENCE_FOLDER, on_exported=release)
+
+    def close_bundler():
+        if bundler is not None:
+            bundler.close()
+
+    pipeline = Pipeline([
+        Stage("decode", decode),
+        Stage("infer", infer, on_close=close_workers),
+        Stage("publish", publish, on_close=close_publishing),
+        Stage("label", label, on_close=close_bundler),
+        Stage("annotate", annotate),
+    ], new_config["pipeline_queue_size"], new_config["pipeline_backpressure"])
+    return pipeline
+
+
+def refresh_worker_pool(pool, num_workers, handle_result, infer_options):
+    r"""
+    Returns a worker pool running the current model of the model manager. The given pool is
+    reused unless the model was swapped or one of its workers died, in which case it is drained
+    and replaced.
+
+    :param pool: the current worker pool, or None.
+    :param num_workers: number of worker processes.
+    :param handle_result: function called with the image path, the image and the box details of every predicted image.
+    :param infer_options: keyword arguments of infer_batch.
+    :return: a worker pool running the current model.
+    """
+    if pool is not None and not pool.broken and pool.model_key == MODEL_MANAGER.current_key:
+        return pool
+    if pool is not None:
+        pool.close()
+    return WorkerPool(num_workers, MODEL_MANAGER.current_key, handle_result, infer_options)
 
 
 def wait_for_config_changes():
@@ -99,15 +639,52 @@ def wait_for_config_changes():
     wait_for_config_changes()
 
 
-ipc = ipc_utils.IPCUtils()
+def shutdown(signum, frame):
+    r"""
+    Stops the inference loop and waits for the publishes in flight and the queued uploads when
+    Greengrass stops the component.
+    """
+    config_utils.logger.info("Stopping the component on signal {}".format(signum))
+    if config_utils.STOP_EVENT is not None:
+        config_utils.STOP_EVENT.set()
+        config_utils.INFERENCE_THREAD.join(config_utils.TIMEOUT)
+    PUBLISHER.flush()
+    UPLOADER.close()
+    # The watcher and configuration threads never return
+    _exit(0)
+
+
+# Worker processes are spawned and import this module again, they must not start the component
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, shutdown)
+
+    ipc = ipc_utils.IPCUtils()
+
+    # Get intial configuration from the recipe and run inference for the first time.
+    set_configuration(ipc.get_configuration())
+
+    # Create the S3 export stream once for the lifetime of the component
+    UPLOADER.start()
+
+    # Drop the staged images a previous run no longer links
+    prune_store()
+
+    # Subscribe to the subsequent configuration changes
+    ipc.get_config_updates()
 
-# Get intial configuration from the recipe and run inference for the first time.
-set_configuration(ipc.get_configuration())
+    # Swap in the model whenever the model artifact is updated
+    Thread(
+        target=MODEL_MANAGER.watch,
+        args=(Event(),),
+    ).start()
 
-# Subscribe to the subsequent configuration changes
-ipc.get_config_updates()
+    # Publish metric snapshots for the lifetime of the component
+    Thread(
+        target=METRICS.publish_periodically,
+        args=(Event(),),
+    ).start()
 
-Thread(
-    target=wait_for_config_changes,
-    args=(),
-).start()
+    Thread(
+        target=wait_for_config_changes,
+        args=(),
+    ).start()
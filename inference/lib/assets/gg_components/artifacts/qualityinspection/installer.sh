@@ -23,9 +23,15 @@ END
     fi
 }
 
+inference_engine="${1:-ultralytics}"
+
 install_lib "opencv-python" "cv2"
 install_lib "numpy" "numpy"
-install_lib "ultralytics" "ultralytics"
+install_lib "onnxruntime" "onnxruntime"
+# The native onnxruntime engine does not need Ultralytics and torch
+if [[ "$inference_engine" != "onnxruntime" ]]; then
+    install_lib "ultralytics" "ultralytics"
+fi
 install_lib "awsiotsdk" "awsiot"
 install_lib "cbor2" "cbor2" #GGv2 Stream Manager req
 install_lib "sysv_ipc" "sysv_ipc"
@@ -0,0 +1,164 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import tarfile
+from datetime import datetime, timezone
+from io import BytesIO
+from os import path, rename
+from threading import Condition, Thread
+from time import monotonic, time
+
+import config_utils
+import cv2
+import numpy as np
+from metrics import METRICS
+from upload_transform import transform_for_upload
+
+MANIFEST_NAME = "manifest.json"
+# Prefix of the PAX header records which are stored as S3 object metadata when the bundle is unpacked
+PAX_METADATA_PREFIX = "S3.metadata."
+
+
+class LabelBundler:
+    r"""
+    Collects the images to label into tar archives and uploads one archive per bundle instead of
+    one object per image. A bundle is closed once it reaches the byte budget or the age budget,
+    and gets a manifest.json member listing its images last. The labeling pipeline unpacks the
+    bundles into single images before it checks for missing labels. With an upload transform, the
+    images are re-encoded first, and the transform of every image is stored in the PAX header of
+    its member and in the manifest, so that it ends up as metadata of the unpacked object.
+    """
+
+    def __init__(self, upload, bundle_dir, max_bytes, max_age_secs, transform=None):
+        r"""
+        :param upload: function called with the path of every closed bundle, which uploads it and removes it once exported.
+        :param bundle_dir: directory the bundles are written to.
+        :param max_bytes: byte budget of a bundle.
+        :param max_age_secs: longest time a bundle is open.
+        :param transform: optional UploadTransform the images are re-encoded with.
+        """
+        self.bundle_dir = bundle_dir
+        self.transform = transform
+        self.max_bytes = max_bytes
+        self.max_age_secs = max_age_secs
+        self._upload = upload
+        self._condition = Condition()
+        self._bundle = None
+        self._closed = False
+        self._thread = Thread(target=self._run, name="label-bundler")
+        self._thread.start()
+
+    def add(self, image_path: str, image: np.ndarray = None) -> None:
+        r"""
+        Adds an image to the open bundle, opening one if needed.
+
+        :param image_path: path of the image.
+        :param image: decoded image, encoded as JPEG if the image has no file to add.
+        """
+        image_name = path.basename(image_path)
+        if self.transform is not None and self.transform.enabled():
+            encoded, metadata = transform_for_upload(image_path, image, self.transform)
+            info = tarfile.TarInfo(image_name)
+            info.size = len(encoded)
+            info.mtime = path.getmtime(image_path) if path.isfile(image_path) else time()
+            info.pax_headers = {PAX_METADATA_PREFIX + key: value for key, value in metadata.items()}
+            data = BytesIO(encoded)
+        elif path.isfile(image_path):
+            info = tarfile.TarInfo(image_name)
+            info.size = path.getsize(image_path)
+            info.mtime = path.getmtime(image_path)
+            data = open(image_path, "rb")
+        else:
+            # Frames decoded from a video have no file to add
+            encoded = cv2.imencode(".jpg", image)[1].tobytes()
+            info = tarfile.TarInfo(image_name)
+            info.size = len(encoded)
+            info.mtime = time()
+            data = BytesIO(encoded)
+
+        full = None
+        with data, self._condition:
+            if self._bundle is None:
+                self._bundle = Bundle(self.bundle_dir)
+                self._condition.notify()
+            self._bundle.add(info, data)
+            if self._bundle.size() >= self.max_bytes:
+                full, self._bundle = self._bundle, None
+        config_utils.logger.info(f"Added image {image_name} to a labeling bundle")
+        if full is not None:
+            self._ship(full)
+
+    def close(self):
+        r"""
+        Closes and uploads the open bundle and stops the background thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            with self._condition:
+                if self._bundle is None and not self._closed:
+                    self._condition.wait()
+                    continue
+                closed = self._closed
+                if not closed:
+                    remaining = self._bundle.started + self.max_age_secs - monotonic()
+                    if remaining > 0:
+                        self._condition.wait(remaining)
+                        continue
+                bundle, self._bundle = self._bundle, None
+            if bundle is not None:
+                self._ship(bundle)
+
+    def _ship(self, bundle):
+        # Called without the lock, so that adding images does not wait for a full upload queue
+        bundle_path = bundle.close()
+        METRICS.count("labeling_bundles")
+        config_utils.logger.info(
+            "Uploading labeling bundle {} of {} images".format(bundle_path, len(bundle.images)))
+        self._upload(bundle_path)
+
+
+class Bundle:
+    r"""
+    Tar archive of images, written to a part file which is renamed once the archive is complete.
+    """
+
+    def __init__(self, bundle_dir):
+        created = datetime.now(tz=timezone.utc)
+        self.created = str(created)
+        self.started = monotonic()
+        self.images = []
+        self.path = path.join(bundle_dir, "bundle-{}.tar".format(created.strftime("%Y-%m-%d-%H-%M-%S-%f")))
+        self._archive = tarfile.open(self.path + ".part", "w", format=tarfile.PAX_FORMAT)
+
+    def add(self, info, data):
+        self._archive.addfile(info, data)
+        image = {"name": info.name, "bytes": info.size,
+                 "captured": str(datetime.fromtimestamp(info.mtime, tz=timezone.utc))}
+        metadata = {key[len(PAX_METADATA_PREFIX):]: value for key, value in info.pax_headers.items()
+                    if key.startswith(PAX_METADATA_PREFIX)}
+        if metadata:
+            image["metadata"] = metadata
+        self.images.append(image)
+
+    def size(self):
+        return self._archive.offset
+
+    def close(self):
+        r"""
+        :return: path of the complete archive.
+        """
+        manifest = json.dumps({"created": self.created, "images": self.images}).encode()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(manifest)
+        info.mtime = time()
+        self._archive.addfile(info, BytesIO(manifest))
+        self._archive.close()
+        rename(self.path + ".part", self.path)
+        return self.path
@@ -0,0 +1,189 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+import resource
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from os import sysconf
+from threading import Lock
+from time import monotonic, perf_counter
+
+import config_utils
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    r"""
+    Histogram of latencies with logarithmic buckets, in the manner of an HDR histogram: every
+    bucket is wider than the previous one by a fixed ratio, so percentiles are exact to within
+    that relative precision from microseconds to minutes, with a bounded number of buckets and
+    constant time recording.
+    """
+
+    def __init__(self, precision=config_utils.METRICS_HISTOGRAM_PRECISION):
+        r"""
+        :param precision: relative width of a bucket, for eg. 0.01 for percentiles within 1%.
+        """
+        self._log_base = math.log1p(precision)
+        self._buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        microseconds = max(seconds * 1e6, 1.0)
+        bucket = int(math.log(microseconds) / self._log_base)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        r"""
+        :param percent: percentile between 0 and 100.
+        :return: upper bound of the bucket holding the percentile, in seconds, or 0 if nothing was recorded.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(math.exp((bucket + 1) * self._log_base) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        r"""
+        :return: dictionary with the count, mean, max and percentiles of the latencies in milliseconds.
+        """
+        summary = {"count": self.count,
+                   "mean_ms": round(1000 * self.total / self.count, 3) if self.count else 0.0,
+                   "max_ms": round(1000 * self.max, 3)}
+        for percent in PERCENTILES:
+            summary["p{}_ms".format(percent)] = round(1000 * self.percentile(percent), 3)
+        return summary
+
+
+def rss_bytes():
+    r"""
+    :return: current resident set size of this process in bytes, or the peak size where the current size is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    r"""
+    Collects per-stage latency histograms, counters and gauges of the inference component.
+    Histograms and counters cover the interval since the last snapshot, gauges are read when the
+    snapshot is taken. Recording takes a lock, so metrics can be recorded from any thread.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {"rss_bytes": rss_bytes}
+        self._interval_started = monotonic()
+
+    def observe(self, stage, seconds):
+        r"""
+        :param stage: name of the stage, for eg. decode or publish.
+        :param seconds: time the stage took.
+        """
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        r"""
+        Records the time spent in the with block in the histogram of the stage.
+
+        :param stage: name of the stage.
+        """
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, perf_counter() - started)
+
+    def count(self, name, value=1):
+        r"""
+        :param name: name of the counter, for eg. frames.
+        :param value: amount to add.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, read):
+        r"""
+        :param name: name of the gauge, for eg. queue_depth.infer.
+        :param read: function returning the current value of the gauge, or None to remove the gauge.
+        """
+        with self._lock:
+            if read is None:
+                self._gauges.pop(name, None)
+            else:
+                self._gauges[name] = read
+
+    def snapshot(self):
+        r"""
+        Returns the metrics of the interval since the last snapshot and starts a new interval.
+
+        :return: dictionary with the stage latencies, counters and gauges.
+        """
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            counters, self._counters = self._counters, {}
+            gauges = dict(self._gauges)
+            now = monotonic()
+            interval_secs, self._interval_started = now - self._interval_started, now
+
+        gauge_values = {}
+        for name, read in gauges.items():
+            try:
+                gauge_values[name] = read()
+            except Exception as e:
+                config_utils.logger.warning(
+                    "Error reading the gauge {}: {}".format(name, e))
+        return {
+            "timestamp": str(datetime.now(tz=timezone.utc)),
+            "interval_secs": round(interval_secs, 3),
+            "stages": {stage: histogram.summary() for stage, histogram in histograms.items()},
+            "counters": counters,
+            "gauges": gauge_values,
+        }
+
+    def publish_periodically(self, stop_event):
+        r"""
+        Publishes a snapshot to the metrics topic every METRICS_INTERVAL_SECS seconds until the stop
+        event is set. Snapshots are only logged if no metrics topic is configured.
+
+        :param stop_event: event which ends the loop when set.
+        """
+        # The publisher records its own metrics, so it is only imported once both modules are loaded
+        from publisher import PUBLISHER
+
+        while not stop_event.wait(config_utils.METRICS_INTERVAL_SECS):
+            try:
+                snapshot = self.snapshot()
+                if config_utils.METRICS_TOPIC.strip() != "":
+                    PUBLISHER.publish_async(snapshot, topic=config_utils.METRICS_TOPIC)
+                else:
+                    config_utils.logger.info("Metrics: {}".format(snapshot))
+            except Exception as e:
+                config_utils.logger.exception(
+                    "Error publishing the metrics: {}".format(e))
+
+
+METRICS = Metrics()
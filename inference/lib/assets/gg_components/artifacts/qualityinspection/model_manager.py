@@ -0,0 +1,240 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+from collections import OrderedDict
+from os import path, stat
+from threading import Lock
+from time import perf_counter
+
+import config_utils
+import numpy as np
+
+
+def load_yolo_model(model_path, num_threads=0):
+    r"""
+    Loads a model with Ultralytics YOLO.
+
+    :param model_path: path of the model artifact.
+    :param num_threads: number of threads torch may use in this process. All cores if 0.
+    :return: the loaded model.
+    """
+    from ultralytics import YOLO
+    if num_threads > 0:
+        import torch
+        torch.set_num_threads(num_threads)
+    return YOLO(model_path, task='detect')
+
+
+def load_onnx_model(model_path, num_threads=0):
+    r"""
+    Loads a YOLOv8 ONNX model with the native onnxruntime engine.
+
+    :param model_path: path of the model artifact.
+    :param num_threads: number of threads onnxruntime may use for one inference. All cores if 0.
+    :return: the loaded model.
+    """
+    from onnx_engine import OnnxYoloEngine
+    return OnnxYoloEngine(model_path, num_threads=num_threads)
+
+
+LOADERS = {
+    "ultralytics": load_yolo_model,
+    "onnxruntime": load_onnx_model,
+}
+
+
+def warm_up(model):
+    r"""
+    Runs one inference on a blank frame so that the first real frame does not pay for the
+    lazy initialization of the model.
+
+    :param model: the loaded model.
+    """
+    frame = np.zeros((*config_utils.SHAPE, 3), dtype=np.uint8)
+    model.predict(source=frame, conf=config_utils.SCORE_THRESHOLD, verbose=False)
+
+
+def model_variant_path(model_dir, model_name, variant):
+    r"""
+    :param model_dir: directory of the model artifacts.
+    :param model_name: file name of the FP32 model, for eg. best.onnx
+    :param variant: one of MODEL_VARIANTS.
+    :return: path of the model variant, for eg. best.int8.onnx for the int8 variant.
+    """
+    if variant == "fp32":
+        return path.join(model_dir, model_name)
+    stem, extension = path.splitext(model_name)
+    return path.join(model_dir, "{}.{}{}".format(stem, variant, extension))
+
+
+def measure_latency(model, runs=config_utils.MODEL_BENCHMARK_RUNS):
+    r"""
+    :param model: the loaded and warmed up model.
+    :param runs: number of inferences to time.
+    :return: median seconds per inference on a blank frame.
+    """
+    frame = np.zeros((*config_utils.SHAPE, 3), dtype=np.uint8)
+    latencies = []
+    for _ in range(runs):
+        started = perf_counter()
+        model.predict(source=frame, conf=config_utils.SCORE_THRESHOLD, verbose=False)
+        latencies.append(perf_counter() - started)
+    return float(np.median(latencies))
+
+
+class ModelManager:
+    r"""
+    Holds the model used for inference. Loaded models are cached by inference engine, model path
+    and file hash, so a configuration update which changes neither the engine nor the model
+    artifact does not reload it. A changed artifact is loaded and warmed up while the current model
+    keeps serving, and is then swapped in with a single reference assignment, so the inference loop
+    never waits for a model load.
+    """
+
+    def __init__(self, loaders, cache_size=config_utils.MODEL_CACHE_SIZE):
+        r"""
+        :param loaders: dictionary of inference engine names to functions which load a model from a model path.
+        :param cache_size: number of loaded models to keep, including the current one.
+        """
+        self._loaders = loaders
+        self._engine = config_utils.DEFAULT_INFERENCE_ENGINE
+        self._cache_size = cache_size
+        self._models = OrderedDict()
+        self._signatures = {}
+        self._current = None
+        self._current_key = None
+        self._model_path = None
+        self._variant_selection = None
+        self._load_lock = Lock()
+
+    def get(self):
+        r"""
+        :return: the current model, or None if no model was loaded yet.
+        """
+        return self._current
+
+    @property
+    def current_key(self):
+        r"""
+        :return: inference engine, model path and file hash of the current model, or None if no model was loaded yet.
+        """
+        return self._current_key
+
+    def load(self, model_path, engine=None):
+        r"""
+        Makes the model at model_path the current model. The model is only loaded if it is neither
+        current nor cached.
+
+        :param model_path: path of the model artifact.
+        :param engine: name of the inference engine to load the model with. Defaults to the engine of the last load.
+        :return: True if the current model changed.
+        """
+        with self._load_lock:
+            if engine is not None:
+                if engine not in self._loaders:
+                    raise ValueError("Unknown inference engine: {}".format(engine))
+                self._engine = engine
+            self._model_path = model_path
+            key = (self._engine, model_path, self._file_hash(model_path))
+            if key == self._current_key:
+                return False
+
+            model = self._models.pop(key, None)
+            if model is None:
+                config_utils.logger.info(
+                    "Loading model {1} with hash {2} using {0}".format(*key))
+                model = self._loaders[self._engine](model_path)
+                warm_up(model)
+            self._cache(key, model)
+
+            self._current = model
+            self._current_key = key
+            config_utils.logger.info(
+                "Swapped in model {1} with hash {2} using {0}".format(*key))
+            return True
+
+    def select_variant(self, model_dir, model_name, variant, engine):
+        r"""
+        Resolves the model variant to load. With the auto variant, every variant present in the
+        model dir is loaded with the engine and timed on a few inferences, and the fastest one is
+        selected. The selection is kept until the engine or one of the model files changes.
+
+        :param model_dir: directory of the model artifacts.
+        :param model_name: file name of the FP32 model.
+        :param variant: one of MODEL_VARIANTS or auto.
+        :param engine: name of the inference engine the variants are run with.
+        :return: path of the selected model variant.
+        """
+        if variant != "auto":
+            if variant not in config_utils.MODEL_VARIANTS:
+                raise ValueError("Unknown model variant: {}".format(variant))
+            return model_variant_path(model_dir, model_name, variant)
+
+        with self._load_lock:
+            candidates = [model_variant_path(model_dir, model_name, candidate)
+                          for candidate in config_utils.MODEL_VARIANTS]
+            keys = tuple((engine, candidate, self._file_hash(candidate))
+                         for candidate in candidates if path.isfile(candidate))
+            if self._variant_selection is not None and self._variant_selection[0] == keys:
+                return self._variant_selection[1]
+
+            fastest_key, fastest_model, fastest_latency = None, None, None
+            for key in keys:
+                model = self._models.get(key)
+                if model is None:
+                    model = self._loaders[engine](key[1])
+                    warm_up(model)
+                latency = measure_latency(model)
+                config_utils.logger.info(
+                    "Model variant {} takes {:.1f}ms per inference using {}".format(key[1], latency * 1000, engine))
+                if fastest_latency is None or latency < fastest_latency:
+                    fastest_key, fastest_model, fastest_latency = key, model, latency
+
+            # Keep the winner so that loading it does not pay the load cost again
+            self._cache(fastest_key, fastest_model)
+            self._variant_selection = (keys, fastest_key[1])
+            config_utils.logger.info(
+                "Selected model variant {}".format(fastest_key[1]))
+            return fastest_key[1]
+
+    def watch(self, stop_event):
+        r"""
+        Reloads the model whenever the artifact of the last loaded model changes, until the stop
+        event is set. The artifact is checked every MODEL_REFRESH_INTERVAL_SECS seconds.
+
+        :param stop_event: event which ends the watch when set.
+        """
+        while not stop_event.wait(config_utils.MODEL_REFRESH_INTERVAL_SECS):
+            if self._model_path is None:
+                continue
+            try:
+                self.load(self._model_path)
+            except Exception as e:
+                config_utils.logger.exception(
+                    "Error reloading the model {}: {}".format(self._model_path, e))
+
+    def _cache(self, key, model):
+        self._models.pop(key, None)
+        self._models[key] = model
+        while len(self._models) > self._cache_size:
+            self._models.popitem(last=False)
+
+    def _file_hash(self, model_path):
+        # Only hash the file again if its size or modification time changed
+        file_stat = stat(model_path)
+        signature = (file_stat.st_mtime_ns, file_stat.st_size)
+        cached = self._signatures.get(model_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        sha256 = hashlib.sha256()
+        with open(model_path, "rb") as model_file:
+            for chunk in iter(lambda: model_file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        file_hash = sha256.hexdigest()
+        self._signatures[model_path] = (signature, file_hash)
+        return file_hash
+
+
+MODEL_MANAGER = ModelManager(LOADERS)
@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from ast import literal_eval
+from threading import Lock
+from typing import List, Tuple
+
+import config_utils
+import numpy as np
+import onnxruntime as ort
+from box_utils import Boxes, Results, nms, xywh_to_xyxy, xyxy_to_xywh
+from metrics import METRICS
+from preprocessing import Preprocessor
+
+STRIDE = 32
+
+
+class OnnxYoloEngine:
+    r"""
+    Runs a YOLOv8 detection model exported to ONNX directly with onnxruntime. Letterboxing, box
+    decoding and non-maximum suppression are done with NumPy, so neither torch nor Ultralytics
+    are needed on the device. predict mirrors the Ultralytics predict API used by prediction_utils.
+
+    Frames are letterboxed into a preallocated input tensor, which is why predict calls on the
+    same engine are serialized.
+    """
+
+    def __init__(self, model_path: str, providers: List[str] = config_utils.ONNX_PROVIDERS, num_threads: int = 0):
+        r"""
+        :param model_path: path of the ONNX model.
+        :param providers: onnxruntime execution providers in order of preference.
+        :param num_threads: number of threads for one inference. All cores if 0.
+        """
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = self._input_size()
+        self._preprocessor = Preprocessor(self.imgsz)
+        self._lock = Lock()
+
+    def predict(self, source, conf: float = config_utils.SCORE_THRESHOLD,
+                iou: float = config_utils.IOU_THRESHOLD, max_det: int = config_utils.MAX_DETECTIONS,
+                **kwargs) -> List[Results]:
+        r"""
+        Predicts the boxes of one or more images in a single forward pass.
+
+        :param source: a BGR image or a list of BGR images as numpy arrays.
+        :param conf: minimum confidence of the returned boxes.
+        :param iou: intersection over union threshold of the non-maximum suppression.
+        :param max_det: maximum number of boxes per image.
+        :return: a list of Results, one per image.
+        """
+        images = source if isinstance(source, list) else [source]
+        with self._lock:
+            with METRICS.timer("preprocess"):
+                batch, transforms = self._preprocessor(images)
+            with METRICS.timer("forward"):
+                predictions = self.session.run(None, {self.input_name: batch})[0]
+        with METRICS.timer("nms"):
+            return [self._decode(prediction, image.shape[:2], transform, conf, iou, max_det)
+                    for prediction, image, transform in zip(predictions, images, transforms)]
+
+    def _decode(self, prediction: np.ndarray, image_shape, transform, conf, iou, max_det) -> Results:
+        # YOLOv8 outputs (4 + number of classes, anchors) with center based boxes in input pixels
+        prediction = prediction.T
+        class_scores = prediction[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        candidates = scores > conf
+        boxes = xywh_to_xyxy(prediction[candidates, :4])
+        scores = scores[candidates]
+        classes = classes[candidates]
+
+        # Offset the boxes by class so that boxes of different classes never suppress each other
+        offsets = classes[:, None] * float(max(self.imgsz))
+        keep = nms(boxes + offsets, scores, iou)[:max_det]
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+        scale, left, top = transform
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - left) / scale
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - top) / scale
+        height, width = image_shape
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        return Results(Boxes(xyxy_to_xywh(boxes), scores, classes))
+
+    def _input_size(self) -> Tuple[int, int]:
+        # Ultralytics stores the export image size in the model metadata. Models exported with
+        # dynamic axes have no static input size, so fall back to SHAPE rounded up to the stride.
+        imgsz = self.session.get_modelmeta().custom_metadata_map.get("imgsz")
+        if imgsz is not None:
+            height, width = literal_eval(imgsz)
+            return int(height), int(width)
+        input_shape = self.session.get_inputs()[0].shape
+        if all(isinstance(dim, int) for dim in input_shape[2:]):
+            return input_shape[2], input_shape[3]
+        return tuple(-(-dim // STRIDE) * STRIDE for dim in config_utils.SHAPE)
+
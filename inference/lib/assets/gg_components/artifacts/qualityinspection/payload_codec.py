@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+r"""
+Encodes the messages the component publishes to IoT Core, and decodes them on the cloud side.
+
+json is the text encoding of the original payloads. cbor encodes the same structure in CBOR.
+cbor-packed also packs the boxes of inference results into binary arrays: confidences as
+little-endian float16 and center x, center y, width and height as little-endian int16 pixels.
+
+Combined messages of several inference results, {"timestamp": ..., "results": [...]}, pack every
+result. This module only depends on the standard library and cbor2, so consumers of the messages
+in the cloud can import it as is and call decode_payload.
+"""
+
+import struct
+from json import dumps, loads
+
+import cbor2
+
+ENCODINGS = ("json", "cbor", "cbor-packed")
+PACKED_VERSION = 1
+INT16_MIN, INT16_MAX = -32768, 32767
+
+
+def encode_payload(payload, encoding="json"):
+    r"""
+    :param payload: dictionary to publish.
+    :param encoding: one of ENCODINGS.
+    :return: the encoded payload as bytes.
+    """
+    if encoding == "json":
+        return dumps(payload).encode()
+    if encoding == "cbor":
+        return cbor2.dumps(payload)
+    if encoding == "cbor-packed":
+        if "results" in payload:
+            # Combined message of several inference results
+            return cbor2.dumps(dict(payload, results=[pack_result(result) for result in payload["results"]]))
+        return cbor2.dumps(pack_result(payload))
+    raise ValueError("Unknown payload encoding: {}".format(encoding))
+
+
+def decode_payload(data):
+    r"""
+    Decodes a payload of any of the ENCODINGS. JSON payloads start with a brace, which no CBOR
+    map does, so the encoding does not need to be known.
+
+    :param data: the message payload as bytes.
+    :return: the payload as dictionary, in the structure of the JSON encoding.
+    """
+    if data[:1] == b"{":
+        return loads(data)
+    payload = cbor2.loads(data)
+    if "results" in payload:
+        return dict(payload, results=[unpack_result(result) for result in payload["results"]])
+    return unpack_result(payload)
+
+
+def pack_result(payload):
+    r"""
+    :param payload: inference results payload, or any other message.
+    :return: the payload with its boxes packed if it has any, else the payload as is.
+    """
+    if not payload.get("inference_results"):
+        return payload
+    return pack_inference_results(payload)
+
+
+def unpack_result(payload):
+    r"""
+    :param payload: decoded CBOR message.
+    :return: the payload with its boxes unpacked if they are packed, else the payload as is.
+    """
+    if "v" in payload:
+        return unpack_inference_results(payload)
+    return payload
+
+
+def pack_inference_results(payload):
+    r"""
+    :param payload: inference results payload with timestamp, image_name and inference_results as returned by get_box_details.
+    :return: dictionary with the boxes packed into bytes.
+    """
+    confidences = payload["inference_results"][0][0]
+    coordinates = payload["inference_results"][1][0]
+    values = [min(INT16_MAX, max(INT16_MIN, round(value)))
+              for box in coordinates for value in box]
+    packed = {
+        "v": PACKED_VERSION,
+        "t": payload["timestamp"],
+        "i": payload["image_name"],
+        "c": struct.pack("<{}e".format(len(confidences)), *confidences),
+        "b": struct.pack("<{}h".format(len(values)), *values),
+    }
+    # Keep any other field as is
+    for key, value in payload.items():
+        if key not in ("timestamp", "image_name", "inference_results"):
+            packed[key] = value
+    return packed
+
+
+def unpack_inference_results(packed):
+    r"""
+    :param packed: dictionary as returned by pack_inference_results.
+    :return: the inference results payload, with confidences and coordinates as lists of floats.
+    """
+    if packed["v"] != PACKED_VERSION:
+        raise ValueError("Unknown packed payload version: {}".format(packed["v"]))
+    confidences = list(struct.unpack("<{}e".format(len(packed["c"]) // 2), packed["c"]))
+    values = struct.unpack("<{}h".format(len(packed["b"]) // 2), packed["b"])
+    coordinates = [[float(value) for value in values[i:i + 4]] for i in range(0, len(values), 4)]
+    payload = {
+        "timestamp": packed["t"],
+        "image_name": packed["i"],
+        "inference_results": [[confidences], [coordinates]],
+    }
+    for key, value in packed.items():
+        if key not in ("v", "t", "i", "c", "b"):
+            payload[key] = value
+    return payload
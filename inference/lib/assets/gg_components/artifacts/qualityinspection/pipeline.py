@@ -0,0 +1,191 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import deque
+from threading import Condition, Thread
+
+import config_utils
+from metrics import METRICS
+
+BACKPRESSURE_POLICIES = ("block", "drop-oldest", "drop-newest")
+
+
+class StageQueue:
+    r"""
+    Bounded queue in front of a pipeline stage. When the queue is full, put either blocks until the
+    stage takes an item (block), evicts the oldest queued item (drop-oldest) or discards the new
+    item (drop-newest).
+    """
+
+    def __init__(self, maxsize, backpressure):
+        r"""
+        :param maxsize: maximum number of queued items.
+        :param backpressure: one of BACKPRESSURE_POLICIES.
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError("Unknown backpressure policy: {}".format(backpressure))
+        self.maxsize = max(1, maxsize)
+        self.backpressure = backpressure
+        self.dropped = 0
+        self._items = deque()
+        self._condition = Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        r"""
+        :param item: item to queue.
+        :return: False if an item was dropped to respect the size of the queue.
+        """
+        with self._condition:
+            if len(self._items) >= self.maxsize:
+                if self.backpressure == "drop-newest":
+                    self.dropped += 1
+                    METRICS.count("dropped")
+                    return False
+                if self.backpressure == "drop-oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                    METRICS.count("dropped")
+                    self._items.append(item)
+                    self._condition.notify_all()
+                    return False
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._condition.wait()
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self):
+        r"""
+        Blocks until an item is queued.
+
+        :return: the oldest item, or None once the queue is closed and empty.
+        """
+        with self._condition:
+            while not self._items and not self._closed:
+                self._condition.wait()
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        r"""
+        Wakes up the consumer once the queued items are taken. Items put after closing are still queued.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class Stage:
+    r"""
+    Step of a pipeline which runs on its own thread.
+    """
+
+    def __init__(self, name, process, on_close=None):
+        r"""
+        :param name: name of the stage in log messages.
+        :param process: function called with every item of the stage, returning the items to pass to the next stage.
+        :param on_close: optional function called once the stage processed its last item.
+        """
+        self.name = name
+        self.process = process
+        self.on_close = on_close
+
+
+class Pipeline:
+    r"""
+    Runs stages on separate threads connected by bounded queues, so that a slow stage, for eg.
+    publishing to IoT Core or uploading to S3, delays neither the stages before it nor the next
+    frame. How a full queue is handled is set by the backpressure policy. The time every stage
+    takes per item is recorded in the stage histograms of METRICS, and the depth of every queue
+    is reported as a gauge.
+    """
+
+    def __init__(self, stages, queue_size, backpressure):
+        r"""
+        :param stages: list of Stage objects in processing order.
+        :param queue_size: maximum number of items queued in front of every stage.
+        :param backpressure: one of BACKPRESSURE_POLICIES.
+        """
+        self.stages = stages
+        self.queues = [StageQueue(queue_size, backpressure) for _ in stages]
+        self._threads = [Thread(target=self._run, args=(index,), name="pipeline-{}".format(stage.name))
+                         for index, stage in enumerate(stages)]
+        for stage, queue in zip(stages, self.queues):
+            METRICS.set_gauge("queue_depth.{}".format(stage.name), queue.__len__)
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item, stage_name=None):
+        r"""
+        Queues an item for a stage.
+
+        :param item: the item.
+        :param stage_name: name of the stage. Defaults to the first stage.
+        :return: False if an item was dropped because the queue of the stage was full.
+        """
+        index = 0 if stage_name is None else self._index(stage_name)
+        return self.queues[index].put(item)
+
+    def queue_depth(self):
+        r"""
+        :return: total number of items queued in front of the stages.
+        """
+        return sum(len(queue) for queue in self.queues)
+
+    def dropped(self):
+        r"""
+        :return: dictionary of stage names to the number of items dropped in front of the stage.
+        """
+        return {stage.name: queue.dropped for stage, queue in zip(self.stages, self.queues)}
+
+    def close(self):
+        r"""
+        Lets every stage finish its queued items, in pipeline order, and stops the stage threads.
+        """
+        for queue, thread in zip(self.queues, self._threads):
+            queue.close()
+            thread.join()
+        for stage in self.stages:
+            METRICS.set_gauge("queue_depth.{}".format(stage.name), None)
+        dropped = {name: count for name, count in self.dropped().items() if count > 0}
+        if dropped:
+            config_utils.logger.warning(
+                "Pipeline dropped items in front of stages: {}".format(dropped))
+
+    def _index(self, stage_name):
+        for index, stage in enumerate(self.stages):
+            if stage.name == stage_name:
+                return index
+        raise ValueError("Unknown pipeline stage: {}".format(stage_name))
+
+    def _run(self, index):
+        stage = self.stages[index]
+        queue = self.queues[index]
+        next_queue = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            try:
+                with METRICS.timer(stage.name):
+                    outputs = stage.process(item)
+            except Exception as e:
+                config_utils.logger.exception(
+                    "Error in pipeline stage {}: {}".format(stage.name, e))
+                continue
+            if next_queue is not None:
+                for output in outputs or ():
+                    next_queue.put(output)
+        if stage.on_close is not None:
+            try:
+                stage.on_close()
+            except Exception as e:
+                config_utils.logger.exception(
+                    "Error closing pipeline stage {}: {}".format(stage.name, e))
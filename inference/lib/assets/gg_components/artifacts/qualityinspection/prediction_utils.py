@@ -1,131 +1,380 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-import shutil
 from datetime import datetime, timezone
+from fnmatch import fnmatch
 from os import listdir, path
 from typing import List
 
 import config_utils
 import cv2
-import IPCUtils as ipc_utils
 import numpy as np
-from ultralytics import YOLO
+from box_utils import Boxes, Results, nms, xywh_to_xyxy
+from frame_cache import FRAME_CACHE
+from metrics import METRICS
+from publisher import PUBLISHER
+from staging import release, stage_bytes, stage_file
+from upload_transform import UploadTransform, transform_for_upload
+from uploader import UPLOADER
 
 config_utils.logger.info("Using np from '{}'.".format(np.__file__))
 config_utils.logger.info("Using cv2 from '{}'.".format(cv2.__file__))
 
 
-def transform_image(im):
-    if len(im.shape) == 2:
-        im = np.expand_dims(im, axis=2)
-        nchannels = 1
-    elif len(im.shape) == 3:
-        nchannels = im.shape[2]
-    else:
-        raise Exception("Unknown image structure")
-    if nchannels == 1:
-        im = cv2.cvtColor(im, cv2.COLOR_GRAY2RGB)
-    elif nchannels == 4:
-        im = cv2.cvtColor(im, cv2.COLOR_BGRA2RGB)
-    elif nchannels == 3:
-        im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
-    return im
-
-
-
 def load_images(image_dir):
     r"""
     Validates the image type irrespective of its case. For eg. both .PNG and .png are valid image types.
-    Also, accepts numpy array images.
+    The images are not decoded here. They are decoded and cached by the frame cache the first time they are predicted.
 
     :param image_dir: path of the image dir on the device.
-    :return: a dictionary of numpy arrays of shape (1, input_shape_x, input_shape_y, no_of_channels)
+    :return: a list of the image names in the image dir.
     """
-    image_data = {}
+    image_names = []
     for image in listdir(image_dir):
         if image.endswith(('jpg', 'jpeg')):
-            try:
-                image_data[image] = cv2.imread(path.join(image_dir, image))
-            except Exception as e:
-                config_utils.logger.error(
-                    "Unable to read the image {} at: {}. Error: {}".format(
-                        image, image_dir, e))
-                exit(1)
+            image_names.append(image)
         else:
             config_utils.logger.error(
                 "Images of format jpg, jpeg are only supported.")
             exit(1)
-    return image_data
+    return image_names
 
 
-def predict(image_name: str, onnx_model: YOLO) -> None:
+def predict(image_path: str, onnx_model, image: np.ndarray = None) -> None:
     """
     Predicts the boxes for the given image.
 
-    :param image_name: name of the image.
-    :param onnx_model: onnx model.
+    :param image_path: path of the image.
+    :param onnx_model: onnx model, loaded with Ultralytics or the native onnxruntime engine.
+    :param image: decoded image. Taken from the frame cache if not given.
+    :return: None
+    """
+    predict_batch([image_path], onnx_model, 1, [image])
+
+
+def predict_batch(image_paths: List[str], onnx_model, batch_size: int, images: List[np.ndarray] = None, **infer_options) -> None:
+    """
+    Predicts the boxes for the given images. The images are stacked into batches of batch_size
+    images, and each batch is run through the model in a single forward pass.
+
+    :param image_paths: paths of the images.
+    :param onnx_model: onnx model, loaded with Ultralytics or the native onnxruntime engine. Must be exported with a dynamic batch dimension if batch_size is larger than 1.
+    :param batch_size: maximum number of images per forward pass.
+    :param images: decoded images in the order of image_paths. Images which are None are taken from the frame cache.
+    :param infer_options: keyword arguments of infer_batch, for eg. tile_size.
+    :return: None
+    """
+    if images is None:
+        images = [None] * len(image_paths)
+
+    for start in range(0, len(image_paths), batch_size):
+        batch_paths, batch_images = [], []
+        for image_path, image in zip(image_paths[start:start + batch_size], images[start:start + batch_size]):
+            if image is None:
+                image = FRAME_CACHE.get_or_none(image_path)
+                if image is None:
+                    continue
+            batch_paths.append(image_path)
+            batch_images.append(image)
+        if not batch_paths:
+            continue
+        config_utils.logger.debug(f"Predicting batch of {len(batch_paths)} images")
+        for image_path, image, boxes in zip(batch_paths, batch_images, infer_batch(batch_images, onnx_model, batch_paths, **infer_options)):
+            handle_prediction(image_path, image, boxes)
+
+
+def infer_batch(images: List[np.ndarray], onnx_model, image_paths: List[str] = None, tile_size: int = 0,
+                tile_overlap: int = 0, regions_of_interest=None, min_confidence: float = None) -> List[List]:
+    """
+    Runs the model on the given images in a single forward pass.
+
+    With regions of interest, only the crops of the regions of an image go through the model
+    instead of the whole frame.
+
+    With a tile size, every image or crop larger than a tile is also cut into overlapping tiles of
+    tile_size pixels, which the model sees at their full resolution instead of downscaled with
+    the whole frame.
+
+    Crops, tiles and whole frames go through the model as one batch. Their boxes are mapped back to
+    frame coordinates and merged per image with non-maximum suppression.
+
+    :param images: decoded images.
+    :param onnx_model: onnx model, loaded with Ultralytics or the native onnxruntime engine.
+    :param image_paths: paths of the images, used to look up their regions of interest.
+    :param tile_size: width and height of the tiles in pixels. Images are not tiled if 0.
+    :param tile_overlap: number of pixels neighbouring tiles overlap by, so that a defect on the border of a tile is whole in its neighbour.
+    :param regions_of_interest: regions as accepted by regions_for.
+    :param min_confidence: optional confidence below the score threshold down to which boxes are kept as candidates, for eg. for the labeling sampler.
+    :return: box details as returned by get_box_details, one per image.
+    """
+    conf = config_utils.SCORE_THRESHOLD if min_confidence is None else min(min_confidence, config_utils.SCORE_THRESHOLD)
+    if tile_size <= 0 and not regions_of_interest:
+        results = run_model(images, onnx_model, conf)
+        return [get_box_details([result], min_confidence) for result in results]
+
+    sources, origins, owners = [], [], []
+    for index, image in enumerate(images):
+        regions = regions_for(image_paths[index], regions_of_interest) if regions_of_interest else None
+        for view, (view_left, view_top) in crop_regions(image, regions):
+            sources.append(view)
+            origins.append((view_left, view_top))
+            owners.append(index)
+            height, width = view.shape[:2]
+            if tile_size <= 0 or (height <= tile_size and width <= tile_size):
+                continue
+            for top in tile_starts(height, tile_size, tile_overlap):
+                for left in tile_starts(width, tile_size, tile_overlap):
+                    # Tiles are views of the frame, they are only copied into the model input
+                    sources.append(view[top:top + tile_size, left:left + tile_size])
+                    origins.append((view_left + left, view_top + top))
+                    owners.append(index)
+    config_utils.logger.debug(f"Predicting {len(sources)} crops and tiles of {len(images)} images")
+
+    parts = [[] for _ in images]
+    for result, (left, top), owner in zip(run_model(sources, onnx_model, conf) if sources else [], origins, owners):
+        xywh = to_numpy(result.boxes.xywh).astype(np.float32)
+        xywh[:, 0] += left
+        xywh[:, 1] += top
+        parts[owner].append((xywh, to_numpy(result.boxes.conf), to_numpy(result.boxes.cls)))
+    return [get_box_details([merge_boxes(image_parts, max(image.shape[:2]))], min_confidence)
+            for image_parts, image in zip(parts, images)]
+
+
+def regions_for(image_path: str, regions_of_interest):
+    """
+    :param image_path: path of the image.
+    :param regions_of_interest: a list of [x, y, width, height] rectangles in pixels, used for all images, or a dictionary of image name patterns, for eg. camera1-*.jpg, to the rectangles of the images matching the pattern. The first matching pattern wins.
+    :return: the rectangles of the image, or None to predict the whole frame.
+    """
+    if isinstance(regions_of_interest, list):
+        return regions_of_interest
+    image_name = path.basename(image_path)
+    for pattern, regions in regions_of_interest.items():
+        if fnmatch(image_name, pattern):
+            return regions
+    return None
+
+
+def crop_regions(image: np.ndarray, regions) -> List:
+    """
+    :param image: decoded image.
+    :param regions: list of [x, y, width, height] rectangles in pixels, or None for the whole frame.
+    :return: list of (crop, (left, top)) tuples. Crops are views of the image, clipped to its borders.
+    """
+    if regions is None:
+        return [(image, (0, 0))]
+    height, width = image.shape[:2]
+    crops = []
+    for x, y, region_width, region_height in regions:
+        left, top = max(0, int(x)), max(0, int(y))
+        right, bottom = min(width, int(x + region_width)), min(height, int(y + region_height))
+        if right > left and bottom > top:
+            crops.append((image[top:bottom, left:right], (left, top)))
+    return crops
+
+
+def run_model(images: List[np.ndarray], onnx_model, conf: float = config_utils.SCORE_THRESHOLD) -> List:
+    """
+    :param images: decoded images.
+    :param onnx_model: onnx model, loaded with Ultralytics or the native onnxruntime engine.
+    :param conf: minimum confidence of the returned boxes.
+    :return: the results of the model, one per image.
+    """
+    results = onnx_model.predict(source=images, conf=conf)
+    for result in results:
+        # Ultralytics times its steps per image in milliseconds, the native engine records its own timers
+        speed = getattr(result, "speed", None)
+        if speed:
+            METRICS.observe("preprocess", speed["preprocess"] / 1000)
+            METRICS.observe("forward", speed["inference"] / 1000)
+            METRICS.observe("nms", speed["postprocess"] / 1000)
+    return results
+
+
+def tile_starts(length: int, tile_size: int, tile_overlap: int) -> List[int]:
+    """
+    :param length: width or height of the image.
+    :param tile_size: width or height of the tiles.
+    :param tile_overlap: number of pixels neighbouring tiles overlap by.
+    :return: offsets of the tiles along the dimension. The last tile ends on the border of the image.
+    """
+    if tile_overlap >= tile_size:
+        raise ValueError("The tile overlap must be smaller than the tile size")
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - tile_overlap))
+    starts.append(length - tile_size)
+    return starts
+
+
+def merge_boxes(parts: List, class_offset: float) -> Results:
+    """
+    Merges the boxes of the tiles of an image with non-maximum suppression, so that a defect seen
+    by several tiles is reported once.
+
+    :param parts: list of (xywh, conf, cls) arrays of the tiles, in frame coordinates.
+    :param class_offset: distance to shift the boxes of each class by, so that boxes of different classes never suppress each other.
+    :return: the merged boxes as Results.
+    """
+    if not parts:
+        return Results(Boxes(np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0)))
+    xywh = np.concatenate([part[0] for part in parts]).reshape(-1, 4)
+    conf = np.concatenate([part[1] for part in parts])
+    cls = np.concatenate([part[2] for part in parts])
+    keep = nms(xywh_to_xyxy(xywh) + cls[:, None] * float(class_offset), conf,
+               config_utils.IOU_THRESHOLD)[:config_utils.MAX_DETECTIONS]
+    return Results(Boxes(xywh[keep], conf[keep], cls[keep]))
+
+
+def to_numpy(values) -> np.ndarray:
+    """
+    :param values: a torch tensor of Ultralytics results, or a numpy array.
+    :return: the values as numpy array.
+    """
+    if hasattr(values, "cpu"):
+        return values.cpu().numpy()
+    return np.asarray(values)
+
+
+def handle_prediction(image_path: str, image: np.ndarray, boxes: List) -> None:
+    """
+    Publishes the boxes predicted for an image to the cloud, or uploads the image for labeling if
+    there are no boxes.
+
+    :param image_path: path of the image.
+    :param image: decoded image.
+    :param boxes: box details as returned by get_box_details.
     :return: None
     """
-    config_utils.logger.debug(f"Predicting image: {image_name}")
+    if not publish_prediction(image_path, boxes):
+        upload_for_labeling(image_path, image)
+
+
+def publish_prediction(image_path: str, boxes: List, publish=None) -> bool:
+    """
+    Publishes the boxes predicted for an image to the cloud.
 
+    :param image_path: path of the image.
+    :param boxes: box details as returned by get_box_details.
+    :param publish: optional function called with the payload instead of PUBLISHER.publish_async, for eg. ResultBatcher.add.
+    :return: False if there were no boxes, in which case the image should be uploaded for labeling.
+    """
+    image_name = path.basename(image_path)
     payload = {}
     payload["timestamp"] = str(datetime.now(tz=timezone.utc))
     payload["image_name"] = image_name
     payload["inference_results"] = []
-    boxes = []
-
-    im2 = cv2.imread(
-        f"{config_utils.INFERENCE_COMP_PATH}/qualityinspection/sample_images/{image_name}")
-    results = onnx_model.predict(source=im2, conf=config_utils.SCORE_THRESHOLD)
-    boxes = get_box_details(results)
     config_utils.logger.info(f"Boxes output for image: {image_name} are: {boxes}")
-    
-    if not is_list_empty(boxes):
-        payload["inference_results"] = boxes
 
-        if config_utils.TOPIC.strip() != "":
-            ipc_utils.IPCUtils().publish_results_to_cloud(payload)
-        else:
-            config_utils.logger.warn(
-                "No topic set to publish the inference results to the cloud.")
+    # Candidate boxes below the score threshold are not published
+    boxes = boxes[:2]
+    if is_list_empty(boxes):
+        config_utils.logger.warn(
+            "No detections higher than {}.".format(config_utils.SCORE_THRESHOLD))
+        return False
 
+    payload["inference_results"] = boxes
+    METRICS.count("detections", len(boxes[0][0]))
+    if config_utils.TOPIC.strip() != "":
+        (publish or PUBLISHER.publish_async)(payload)
     else:
         config_utils.logger.warn(
-            "No detections higher than {}.".format(config_utils.SCORE_THRESHOLD))
-        # Upload images to S3 bucket for future labelling
-        save_image_for_labeling(path.join(config_utils.IMAGE_DIR, image_name))
-        ipc_utils.IPCUtils().upload_to_s3(path.join(config_utils.UPLOAD_DIR_LABELING, image_name), config_utils.UPLOAD_BUCKET_LABELING_FOLDER)
+            "No topic set to publish the inference results to the cloud.")
+    return True
+
+
+def upload_for_labeling(image_path: str, image: np.ndarray, transform: UploadTransform = None) -> None:
+    """
+    Uploads an image to the S3 bucket for future labeling.
+
+    :param image_path: path of the image.
+    :param image: decoded image, written out if the image has no file to copy.
+    :param transform: optional UploadTransform the image is re-encoded with. The transform is stored as metadata of the S3 object.
+    :return: None
+    """
+    metadata = save_image_for_labeling(image_path, image, transform)
+    UPLOADER.upload(path.join(config_utils.UPLOAD_DIR_LABELING, path.basename(image_path)),
+                    config_utils.UPLOAD_BUCKET_LABELING_FOLDER, metadata, release)
 
 
-def get_box_details(results) -> List:
+def get_box_details(results, min_confidence: float = None) -> List:
+    """
+    :param results: results of the model, of which the first is used.
+    :param min_confidence: if below the score threshold, the confidences of the boxes between both are returned as third element.
+    :return: [[confidences], [xywh coordinates]] of the boxes above the score threshold, and [[candidate confidences]] with a min_confidence.
+    """
     box_details = [[], []]
-    confidences = results[0].boxes.conf.tolist()
-    coordinates = results[0].boxes.xywh.tolist()
-    box_details[0].append(confidences)
-    box_details[1].append(coordinates)
+    confidences = to_numpy(results[0].boxes.conf)
+    coordinates = to_numpy(results[0].boxes.xywh)
+    if min_confidence is None or min_confidence >= config_utils.SCORE_THRESHOLD:
+        box_details[0].append(confidences.tolist())
+        box_details[1].append(coordinates.tolist())
+        return box_details
+    keep = confidences >= config_utils.SCORE_THRESHOLD
+    box_details[0].append(confidences[keep].tolist())
+    box_details[1].append(coordinates[keep].tolist())
+    box_details.append([confidences[~keep].tolist()])
     return box_details
 
 
-def save_image_for_labeling(image_path: str) -> None:
+def save_image_for_labeling(image_path: str, image: np.ndarray = None, transform: UploadTransform = None):
     image_name = image_path.split("/")[-1]
     config_utils.logger.info(f"Saving image {image_name} for S3 upload and labeling")
-    dest_file_path = f"{config_utils.UPLOAD_DIR_LABELING}/{image_name}"
-    shutil.copyfile(image_path, dest_file_path)
-    config_utils.logger.info(f"Saved image {image_name} for S3 upload and labeling in {dest_file_path}")
+    dest_file_path = path.join(config_utils.UPLOAD_DIR_LABELING, image_name)
+    metadata = None
+    if transform is not None and transform.enabled():
+        data, metadata = transform_for_upload(image_path, image, transform)
+        stage_bytes(data, dest_file_path)
+        method = "transform"
+    elif path.isfile(image_path):
+        method = stage_file(image_path, dest_file_path, config_utils.STAGING_MODE)
+    else:
+        # Frames decoded from a video have no file to stage
+        stage_bytes(cv2.imencode(path.splitext(image_name)[1] or ".jpg", image)[1].tobytes(), dest_file_path)
+        method = "encode"
+    config_utils.logger.info(f"Saved image {image_name} for S3 upload and labeling in {dest_file_path} by {method}")
+    return metadata
 
 
-def generate_bounding_box_image(image_path, detections):
-    image_name = image_path.split("/")[-1]
-    config_utils.logger.info("Generating bounding box image %s", image_name)
-    image_data = cv2.imread(image_path)
-
-    for coords in detections:
-        cv2.rectangle(image_data, (round(coords[0]), round(coords[1])), (round(
-            coords[0]+coords[2]), round(coords[1]+coords[3])), (255, 0, 0), 2)
-    cv2.imwrite(config_utils.UPLOAD_BUCKET_INFERENCE_FOLDER +
-                image_name, image_data)
-    config_utils.logger.info("Generated bounding box image %s", image_name)
+
+def generate_bounding_box_image(image_path: str, image: np.ndarray, boxes: List,
+                                jpeg_quality: int = config_utils.DEFAULT_ANNOTATED_JPEG_QUALITY,
+                                scale: float = 1.0) -> str:
+    """
+    Draws the predicted boxes on a copy of the decoded frame and stages it as JPEG in the
+    inference upload directory. The frame is downscaled before drawing, so that the copy and the
+    encoding only cost the pixels which are written. The image is staged like the images for
+    labeling, so that an upload never reads a partly written image of the same name, and is
+    removed by release once exported.
+
+    :param image_path: path of the image.
+    :param image: decoded image, which is not modified.
+    :param boxes: box details as returned by get_box_details.
+    :param jpeg_quality: JPEG quality between 0 and 100.
+    :param scale: factor the frame is resized by, for eg. 0.5 for half the width and height.
+    :return: path of the annotated image.
+    """
+    image_name = path.basename(image_path)
+    if scale != 1.0:
+        annotated = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        annotated = image.copy()
+
+    coordinates = boxes[1][0] if boxes and boxes[1] else []
+    xywh = np.asarray(coordinates, dtype=np.float32).reshape(-1, 4) * scale
+    if len(xywh):
+        # The boxes are centers and sizes, drawn as closed polygons in a single call
+        x0, y0 = xywh[:, 0] - xywh[:, 2] / 2, xywh[:, 1] - xywh[:, 3] / 2
+        x1, y1 = x0 + xywh[:, 2], y0 + xywh[:, 3]
+        corners = np.stack([np.stack([x0, y0], 1), np.stack([x1, y0], 1),
+                            np.stack([x1, y1], 1), np.stack([x0, y1], 1)], 1)
+        cv2.polylines(annotated, list(np.round(corners).astype(np.int32)), True, (255, 0, 0), 2)
+
+    encoded = cv2.imencode(".jpg", annotated, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1]
+    dest_file_path = path.join(config_utils.UPLOAD_DIR_INFERENCE, path.splitext(image_name)[0] + ".jpg")
+    stage_bytes(encoded.tobytes(), dest_file_path)
+    config_utils.logger.info("Generated bounding box image %s", dest_file_path)
+    return dest_file_path
 
 
 def is_list_empty(in_list: List) -> bool:
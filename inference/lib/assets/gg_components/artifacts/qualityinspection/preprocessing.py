@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+LETTERBOX_COLOR = 114
+
+
+def transform_image(im, out=None):
+    r"""
+    Converts a grayscale, BGR or BGRA image to RGB.
+
+    :param im: image as numpy array of shape (height, width) or (height, width, channels).
+    :param out: optional preallocated uint8 array of shape (height, width, 3) to write the result to.
+    :return: the RGB image.
+    """
+    if len(im.shape) == 2:
+        im = np.expand_dims(im, axis=2)
+        nchannels = 1
+    elif len(im.shape) == 3:
+        nchannels = im.shape[2]
+    else:
+        raise Exception("Unknown image structure")
+    if nchannels == 1:
+        im = cv2.cvtColor(im, cv2.COLOR_GRAY2RGB, dst=out)
+    elif nchannels == 4:
+        im = cv2.cvtColor(im, cv2.COLOR_BGRA2RGB, dst=out)
+    elif nchannels == 3:
+        im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB, dst=out)
+    return im
+
+
+class Preprocessor:
+    r"""
+    Letterboxes images into a preallocated model input tensor of shape (batch, 3, height, width)
+    with RGB values normalized to [0, 1].
+
+    Resizing, color conversion and normalization write into buffers which are allocated once per
+    input geometry and reused for every following frame, so a stream of frames of the same size
+    is preprocessed without any allocation. The returned input tensor is overwritten by the next
+    call.
+    """
+
+    def __init__(self, input_size: Tuple[int, int], max_batch_size: int = 1):
+        r"""
+        :param input_size: height and width of the model input.
+        :param max_batch_size: number of images to preallocate the input tensor for. The tensor grows if a larger batch is passed.
+        """
+        self.input_size = input_size
+        self._input = np.empty((max_batch_size, 3, *input_size), dtype=np.float32)
+        self._canvas = np.full((*input_size, 3), LETTERBOX_COLOR, dtype=np.uint8)
+        self._canvas_window = None
+        self._geometries = {}
+        self._buffers = {}
+
+    def __call__(self, images: List[np.ndarray]) -> Tuple[np.ndarray, List[Tuple[float, int, int]]]:
+        r"""
+        :param images: BGR, BGRA or grayscale images as numpy arrays.
+        :return: the input tensor for the images and, per image, the scale and left and top padding of the letterbox.
+        """
+        if len(images) > len(self._input):
+            self._input = np.empty(
+                (len(images), 3, *self.input_size), dtype=np.float32)
+        transforms = [self._letterbox(image, self._input[i])
+                      for i, image in enumerate(images)]
+        return self._input[:len(images)], transforms
+
+    def _letterbox(self, image: np.ndarray, out: np.ndarray) -> Tuple[float, int, int]:
+        scale, new_width, new_height, left, top = self._geometry(image.shape[:2])
+        channels = image.shape[2] if len(image.shape) == 3 else 1
+        resized, rgb = self._buffers_for(new_height, new_width, channels)
+
+        cv2.resize(image, (new_width, new_height), dst=resized,
+                   interpolation=cv2.INTER_LINEAR)
+        transform_image(resized, out=rgb)
+
+        # Only repaint the padding when the letterbox window moves
+        window = (top, left, new_height, new_width)
+        if window != self._canvas_window:
+            self._canvas.fill(LETTERBOX_COLOR)
+            self._canvas_window = window
+        np.copyto(self._canvas[top:top + new_height, left:left + new_width], rgb)
+
+        # HWC uint8 to CHW float32 in [0, 1], written straight into the input tensor
+        np.multiply(self._canvas.transpose(2, 0, 1), np.float32(1 / 255), out=out)
+        return scale, left, top
+
+    def _geometry(self, image_shape):
+        geometry = self._geometries.get(image_shape)
+        if geometry is None:
+            height, width = image_shape
+            input_height, input_width = self.input_size
+            scale = min(input_height / height, input_width / width)
+            new_height, new_width = round(height * scale), round(width * scale)
+            left = (input_width - new_width) // 2
+            top = (input_height - new_height) // 2
+            geometry = (scale, new_width, new_height, left, top)
+            self._geometries[image_shape] = geometry
+        return geometry
+
+    def _buffers_for(self, height, width, channels):
+        key = (height, width, channels)
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            resized_shape = (height, width) if channels == 1 else (height, width, channels)
+            buffers = (np.empty(resized_shape, dtype=np.uint8),
+                       np.empty((height, width, 3), dtype=np.uint8))
+            self._buffers[key] = buffers
+        return buffers
@@ -0,0 +1,123 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from concurrent.futures import Future
+from threading import BoundedSemaphore, Condition, Timer
+from time import monotonic
+
+import config_utils
+import IPCUtils as ipc_utils
+from awsiot.greengrasscoreipc.model import PublishToIoTCoreRequest
+from metrics import METRICS
+from payload_codec import encode_payload
+
+
+class Publisher:
+    r"""
+    Publishes messages to IoT Core over the IPC client of the process without waiting for them.
+    At most max_in_flight publishes are in flight, publish_async blocks while that many are.
+    A failed publish is retried with exponential backoff before its future fails.
+    """
+
+    def __init__(self, max_in_flight=config_utils.PUBLISH_MAX_IN_FLIGHT,
+                 max_retries=config_utils.PUBLISH_MAX_RETRIES,
+                 backoff_secs=config_utils.PUBLISH_RETRY_BACKOFF_SECS):
+        r"""
+        :param max_in_flight: maximum number of publishes in flight.
+        :param max_retries: number of times a failed publish is retried.
+        :param backoff_secs: delay of the first retry, doubled for every further retry.
+        """
+        self.max_retries = max_retries
+        self.backoff_secs = backoff_secs
+        self._slots = BoundedSemaphore(max(1, max_in_flight))
+        self._in_flight = set()
+        self._condition = Condition()
+
+    def publish_async(self, payload, topic=None) -> Future:
+        r"""
+        :param payload: dictionary to publish, encoded with the payload encoding of the topic.
+        :param topic: topic to publish to. Defaults to the topic of the inference results.
+        :return: Future which completes once IoT Core accepted the message, or fails after the last retry.
+        """
+        topic_name = topic if topic is not None else config_utils.TOPIC
+        request = PublishToIoTCoreRequest(
+            topic_name=topic_name,
+            qos=config_utils.QOS_TYPE,
+            payload=encode_payload(payload, config_utils.PAYLOAD_ENCODINGS.get(topic_name, "json")),
+        )
+        future = Future()
+        self._slots.acquire()
+        with self._condition:
+            self._in_flight.add(future)
+        future.add_done_callback(self._release)
+        self._attempt(request, future, 0, monotonic())
+        return future
+
+    def in_flight(self):
+        r"""
+        :return: number of publishes in flight.
+        """
+        with self._condition:
+            return len(self._in_flight)
+
+    def flush(self, timeout=config_utils.TIMEOUT):
+        r"""
+        Waits for the publishes in flight, for eg. before the component stops.
+
+        :param timeout: maximum number of seconds to wait.
+        :return: True if no publish is in flight anymore.
+        """
+        deadline = monotonic() + timeout
+        with self._condition:
+            while self._in_flight:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    config_utils.logger.warning(
+                        "{} publishes still in flight".format(len(self._in_flight)))
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _attempt(self, request, future, attempt, started):
+        try:
+            operation = ipc_utils.get_ipc_client().new_publish_to_iot_core()
+            operation.activate(request).add_done_callback(
+                lambda sent: self._on_sent(operation, sent, request, future, attempt, started))
+        except Exception as e:
+            self._on_error(e, request, future, attempt, started)
+
+    def _on_sent(self, operation, sent, request, future, attempt, started):
+        error = sent.exception()
+        if error is not None:
+            self._on_error(error, request, future, attempt, started)
+            return
+        operation.get_response().add_done_callback(
+            lambda response: self._on_response(response, request, future, attempt, started))
+
+    def _on_response(self, response, request, future, attempt, started):
+        error = response.exception()
+        if error is not None:
+            self._on_error(error, request, future, attempt, started)
+            return
+        METRICS.observe("publish_ack", monotonic() - started)
+        future.set_result(None)
+
+    def _on_error(self, error, request, future, attempt, started):
+        if attempt < self.max_retries:
+            METRICS.count("publish_retries")
+            Timer(self.backoff_secs * 2 ** attempt, self._attempt,
+                  args=(request, future, attempt + 1, started)).start()
+            return
+        config_utils.logger.error(
+            "Publishing to {} failed after {} attempts: {}".format(request.topic_name, attempt + 1, error))
+        METRICS.count("publish_failures")
+        future.set_exception(error)
+
+    def _release(self, future):
+        with self._condition:
+            self._in_flight.discard(future)
+            self._condition.notify_all()
+        self._slots.release()
+
+
+PUBLISHER = Publisher()
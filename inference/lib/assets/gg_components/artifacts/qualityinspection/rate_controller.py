@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import deque
+from glob import glob
+from os import cpu_count, getloadavg
+from threading import Lock
+from time import monotonic
+
+import config_utils
+
+
+def cpu_load():
+    r"""
+    :return: the one minute load average per core, or None where it is not available.
+    """
+    try:
+        return getloadavg()[0] / (cpu_count() or 1)
+    except OSError:
+        return None
+
+
+def temperature():
+    r"""
+    :return: the highest temperature of the thermal zones of the device in degrees Celsius, or None where it is not available.
+    """
+    temperatures = []
+    for zone in glob("/sys/class/thermal/thermal_zone*/temp"):
+        try:
+            with open(zone) as zone_file:
+                temperatures.append(int(zone_file.read()) / 1000)
+        except (OSError, ValueError):
+            continue
+    return max(temperatures) if temperatures else None
+
+
+class RateController:
+    r"""
+    Adapts the period of the inference loop at runtime. The period is halved, down to the minimum
+    period, while recent frames have detections or candidate boxes below the score threshold, and
+    relaxes back to the configured period when they do not. It is doubled, up to the maximum
+    period, while the CPU load, the temperature or the depth of the pipeline queues is over its
+    limit, which takes precedence over speeding up.
+    """
+
+    def __init__(self, base_period_secs, min_period_secs, max_period_secs, max_cpu_load,
+                 max_temperature, max_queue_depth, queue_depth):
+        r"""
+        :param base_period_secs: configured seconds between two frames.
+        :param min_period_secs: shortest period while frames are interesting.
+        :param max_period_secs: longest period while the device is overloaded.
+        :param max_cpu_load: limit of the one minute load average per core.
+        :param max_temperature: limit of the device temperature in degrees Celsius.
+        :param max_queue_depth: limit of the number of items queued in the pipeline.
+        :param queue_depth: function returning the number of items queued in the pipeline.
+        """
+        self.base_period_secs = base_period_secs
+        self.min_period_secs = min(min_period_secs, base_period_secs)
+        self.max_period_secs = max(max_period_secs, base_period_secs)
+        self.max_cpu_load = max_cpu_load
+        self.max_temperature = max_temperature
+        self.max_queue_depth = max_queue_depth
+        self.period_secs = base_period_secs
+        self._queue_depth = queue_depth
+        self._recent = deque(maxlen=config_utils.RATE_CONTROL_WINDOW)
+        self._lock = Lock()
+        self._last_update = monotonic()
+
+    def observe(self, boxes):
+        r"""
+        Records whether a frame had detections, or candidate boxes below the score threshold. The
+        candidates are only returned when inference runs with a min_confidence, for eg. for the
+        labeling sampler, and make the loop speed up on defects the model is not sure about yet.
+
+        :param boxes: box details as returned by get_box_details.
+        """
+        confidences = boxes[0][0] if boxes and boxes[0] else []
+        candidates = boxes[2][0] if len(boxes) > 2 and boxes[2] else []
+        with self._lock:
+            self._recent.append(len(confidences) > 0 or len(candidates) > 0)
+
+    def overload(self):
+        r"""
+        :return: a description of the limit the device is over, or None.
+        """
+        load = cpu_load()
+        if load is not None and load > self.max_cpu_load:
+            return "CPU load {:.2f}".format(load)
+        current_temperature = temperature()
+        if current_temperature is not None and current_temperature > self.max_temperature:
+            return "temperature {:.1f}C".format(current_temperature)
+        depth = self._queue_depth()
+        if depth > self.max_queue_depth:
+            return "queue depth {}".format(depth)
+        return None
+
+    def update(self):
+        r"""
+        Recomputes the period, at most every RATE_CONTROL_INTERVAL_SECS seconds.
+
+        :return: the current period in seconds.
+        """
+        now = monotonic()
+        if now - self._last_update < config_utils.RATE_CONTROL_INTERVAL_SECS:
+            return self.period_secs
+        self._last_update = now
+
+        with self._lock:
+            interesting = any(self._recent)
+        overload = self.overload()
+        if overload is not None:
+            period_secs = min(self.max_period_secs, self.period_secs * 2)
+        elif interesting:
+            period_secs = max(self.min_period_secs, self.period_secs / 2)
+        else:
+            # Relax towards the configured period from either side
+            period_secs = self.period_secs + (self.base_period_secs - self.period_secs) / 2
+            if abs(period_secs - self.base_period_secs) < 0.01 * self.base_period_secs:
+                period_secs = self.base_period_secs
+
+        if period_secs != self.period_secs:
+            config_utils.logger.info(
+                "Changing the inference period from {:.3f}s to {:.3f}s{}".format(
+                    self.period_secs, period_secs,
+                    " due to {}".format(overload) if overload is not None else ""))
+            self.period_secs = period_secs
+        return period_secs
@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import deque
+from datetime import datetime, timezone
+from threading import Condition, Thread
+from time import monotonic
+
+import config_utils
+from metrics import METRICS
+from payload_codec import encode_payload
+
+
+class ResultBatcher:
+    r"""
+    Buffers inference results and publishes them as one combined message, {"timestamp": ...,
+    "results": [...]}, once the encoded results reach the byte budget or the oldest buffered result
+    reaches the latency budget. Results are encoded and published on a background thread, so
+    adding a result never waits for the network.
+    """
+
+    def __init__(self, publish, max_bytes, max_latency_secs, encoding="json"):
+        r"""
+        :param publish: function called with every combined message.
+        :param max_bytes: byte budget of a combined message. A single result over the budget is published alone.
+        :param max_latency_secs: longest time a result is buffered.
+        :param encoding: payload encoding of the topic, to account for the size of the results.
+        """
+        self.max_bytes = max_bytes
+        self.max_latency_secs = max_latency_secs
+        self.encoding = encoding
+        self._publish = publish
+        self._pending = deque()
+        self._condition = Condition()
+        self._closed = False
+        self._thread = Thread(target=self._run, name="result-batcher")
+        self._thread.start()
+
+    def add(self, payload):
+        r"""
+        :param payload: inference result payload as built by publish_prediction.
+        """
+        with self._condition:
+            self._pending.append((monotonic(), payload))
+            self._condition.notify()
+
+    def close(self):
+        r"""
+        Publishes the buffered results and stops the background thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        batch, batch_bytes, started = [], 0, None
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    if not batch:
+                        self._condition.wait()
+                        continue
+                    remaining = started + self.max_latency_secs - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                added = list(self._pending)
+                self._pending.clear()
+                closed = self._closed
+
+            for added_at, payload in added:
+                size = len(encode_payload(payload, self.encoding))
+                if batch and batch_bytes + size > self.max_bytes:
+                    self._flush(batch)
+                    batch, batch_bytes = [], 0
+                if not batch:
+                    started = added_at
+                batch.append(payload)
+                batch_bytes += size
+
+            if batch and (closed or batch_bytes >= self.max_bytes
+                          or monotonic() - started >= self.max_latency_secs):
+                self._flush(batch)
+                batch, batch_bytes = [], 0
+            if closed and not batch:
+                break
+
+    def _flush(self, batch):
+        message = {"timestamp": str(datetime.now(tz=timezone.utc)), "results": batch}
+        try:
+            with METRICS.timer("flush"):
+                self._publish(message)
+            METRICS.count("published_batches")
+        except Exception as e:
+            config_utils.logger.exception(
+                "Error publishing a batch of {} results: {}".format(len(batch), e))
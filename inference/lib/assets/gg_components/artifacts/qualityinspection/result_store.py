@@ -0,0 +1,174 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import sqlite3
+from threading import Condition, Event, Lock, Thread
+from time import time
+
+import config_utils
+from metrics import METRICS
+
+
+class ResultStore:
+    r"""
+    Stores the messages to publish in a SQLite database in WAL mode before they are published, so
+    that results are not lost while IoT Core is unreachable and survive a restart of the
+    component. When the stored messages exceed the byte budget, the oldest ones are evicted.
+    """
+
+    def __init__(self, db_path, max_bytes):
+        r"""
+        :param db_path: path of the database file.
+        :param max_bytes: byte budget of the stored messages.
+        """
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._appended = Condition(self._lock)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # A power loss may lose the last transactions, but never corrupts the database
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload BLOB NOT NULL, created REAL NOT NULL)")
+        self._bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM results").fetchone()[0]
+
+    def append(self, payload, topic=None):
+        r"""
+        :param payload: dictionary to publish.
+        :param topic: topic to publish to. Defaults to the topic of the inference results.
+        """
+        data = json.dumps(payload).encode()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO results (topic, payload, created) VALUES (?, ?, ?)",
+                (topic if topic is not None else config_utils.TOPIC, data, time()))
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._appended.notify_all()
+
+    def oldest(self, limit):
+        r"""
+        :param limit: maximum number of messages.
+        :return: list of (id, topic, payload) of the oldest stored messages, in the order they were stored.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, topic, payload FROM results ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, topic, json.loads(payload)) for row_id, topic, payload in rows]
+
+    def delete(self, row_ids):
+        r"""
+        :param row_ids: ids of the messages to delete, for eg. once they are published.
+        """
+        if not row_ids:
+            return
+        with self._lock:
+            self._delete("id IN ({})".format(",".join("?" * len(row_ids))), row_ids)
+
+    def count(self):
+        r"""
+        :return: number of stored messages.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def wait(self, timeout):
+        r"""
+        Waits until a message is appended, or the timeout.
+
+        :param timeout: maximum number of seconds to wait.
+        """
+        with self._appended:
+            self._appended.wait(timeout)
+
+    def close(self):
+        r"""
+        Closes the database. Messages not shipped yet are shipped after the next start.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def _evict(self):
+        evicted = 0
+        while self._bytes > self.max_bytes:
+            deleted = self._delete(
+                "id IN (SELECT id FROM results ORDER BY id LIMIT ?)", (config_utils.RESULT_STORE_EVICT_ROWS,))
+            if deleted == 0:
+                self._bytes = 0
+                break
+            evicted += deleted
+        METRICS.count("results_evicted", evicted)
+        config_utils.logger.warning(
+            "Evicted the {} oldest results from the result store to stay below {} bytes".format(evicted, self.max_bytes))
+
+    def _delete(self, condition, parameters):
+        self._connection.execute("BEGIN")
+        deleted_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM results WHERE " + condition, parameters).fetchone()[0]
+        deleted = self._connection.execute("DELETE FROM results WHERE " + condition, parameters).rowcount
+        self._connection.execute("COMMIT")
+        self._bytes -= deleted_bytes
+        return deleted
+
+
+class ResultShipper:
+    r"""
+    Publishes the messages of a ResultStore in the order they were stored, in batches of up to
+    batch_size messages in flight. The shipper waits for every message of a batch, and deletes the
+    messages IoT Core accepted up to the first which failed. The shipper then backs off and
+    publishes again from the first failed message, so stored results are replayed in order once
+    the connection is back. Delivery is at least once: the messages after a failed one in its batch,
+    and a message of which the acknowledgment timed out, may be delivered twice.
+    """
+
+    def __init__(self, store, publish_async, batch_size):
+        r"""
+        :param store: the ResultStore.
+        :param publish_async: function called with a payload and a topic, returning a Future, for eg. PUBLISHER.publish_async.
+        :param batch_size: maximum number of messages in flight.
+        """
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self._publish_async = publish_async
+        self._stop_event = Event()
+        self._thread = Thread(target=self._run, name="result-shipper")
+        self._thread.start()
+
+    def close(self):
+        r"""
+        Stops shipping after the batch in flight. Messages not shipped yet stay in the store.
+        """
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        backoff_secs = config_utils.RESULT_SHIP_BACKOFF_SECS
+        while not self._stop_event.is_set():
+            rows = self.store.oldest(self.batch_size)
+            if not rows:
+                self.store.wait(1)
+                continue
+            futures = [self._publish_async(payload, topic) for _, topic, payload in rows]
+            shipped, failed = [], []
+            for (row_id, _, _), future in zip(rows, futures):
+                # Waits for the whole batch, so that no message of it is still in flight when replayed
+                try:
+                    future.result(config_utils.RESULT_SHIP_TIMEOUT_SECS)
+                except Exception as e:
+                    failed.append((row_id, e))
+                    continue
+                if not failed:
+                    shipped.append(row_id)
+            self.store.delete(shipped)
+            if failed:
+                config_utils.logger.warning(
+                    "Shipping {} stored results failed, first at {}, retrying from it in {}s: {}".format(
+                        len(failed), failed[0][0], backoff_secs, failed[0][1]))
+                self._stop_event.wait(backoff_secs)
+                backoff_secs = min(2 * backoff_secs, config_utils.RESULT_SHIP_MAX_BACKOFF_SECS)
+            else:
+                backoff_secs = config_utils.RESULT_SHIP_BACKOFF_SECS
@@ -0,0 +1,211 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+r"""
+Stages images for upload without copying them where the filesystem allows it. Every staged image
+is kept once in a content-addressed store, named after the SHA-256 of its bytes, and the staged
+file is a hard link to it, so repeated frames take the space and the writes of one. An image is
+put into the store by reflink on copy-on-write filesystems, or by hard link, and is only copied
+when the image directory is on another filesystem than the work directory. A hard linked image
+shares its inode with the store, so the camera must replace images rather than rewrite them.
+
+Once a staged image is exported, release removes it, and the store entry when no staged image
+links it anymore, so the store only holds the images waiting for upload.
+"""
+
+import fcntl
+import hashlib
+import shutil
+from os import link, makedirs, path, remove, rename, replace, stat, walk
+from tempfile import mkstemp
+from threading import Lock
+
+import config_utils
+from metrics import METRICS
+
+STAGING_MODES = ("auto", "copy")
+# ioctl of Linux which shares the extents of a file with another one on Btrfs, XFS and others
+FICLONE = 0x40049409
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# Store entries and the number of uploads of each staged path, so that release does not remove
+# an entry another image is being linked to
+_lock = Lock()
+_staged = {}
+
+
+def file_digest(file_path: str) -> str:
+    r"""
+    :param file_path: path of the file.
+    :return: hexadecimal SHA-256 of the content of the file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_path(digest: str, extension: str) -> str:
+    r"""
+    :param digest: hexadecimal SHA-256 of the content.
+    :param extension: extension of the file, for eg. .jpg.
+    :return: path of the content in the store, sharded by the first two digits of the digest.
+    """
+    return path.join(config_utils.STAGING_STORE_DIR, digest[:2], digest + extension)
+
+
+def stage_file(source_path: str, dest_path: str, mode: str = "auto") -> str:
+    r"""
+    :param source_path: path of the image to stage.
+    :param dest_path: path to stage the image at.
+    :param mode: one of STAGING_MODES. copy copies the image, as on filesystems without links.
+    :return: how the image got into the store: reflink, link or copy, or stored if it was already there.
+    """
+    if mode not in STAGING_MODES:
+        raise ValueError("Unknown staging mode: {}".format(mode))
+    if mode == "copy":
+        shutil.copyfile(source_path, dest_path)
+        return "copy"
+
+    extension = path.splitext(source_path)[1]
+    if stat(source_path).st_dev != stat(config_utils.STAGING_STORE_DIR).st_dev:
+        # Another filesystem, the image is copied and hashed in a single pass
+        return _copy_into_store(source_path, dest_path, extension)
+
+    stored = store_path(file_digest(source_path), extension)
+    with _lock:
+        if path.exists(stored):
+            method = "stored"
+            METRICS.count("staged_duplicates")
+        else:
+            makedirs(path.dirname(stored), exist_ok=True)
+            # Stores under a temporary name first, so that the store never holds partial files
+            part_path = stored + ".part"
+            method = _reflink_or_link(source_path, part_path)
+            replace(part_path, stored)
+        _link(stored, dest_path)
+    return method
+
+
+def stage_bytes(data: bytes, dest_path: str) -> None:
+    r"""
+    Stages encoded image bytes, for eg. of a frame decoded from a video, which have no file to link.
+
+    :param data: encoded image.
+    :param dest_path: path to stage the image at.
+    """
+    stored = store_path(hashlib.sha256(data).hexdigest(), path.splitext(dest_path)[1])
+    with _lock:
+        if path.exists(stored):
+            METRICS.count("staged_duplicates")
+        else:
+            makedirs(path.dirname(stored), exist_ok=True)
+            part_path = stored + ".part"
+            with open(part_path, "wb") as part:
+                part.write(data)
+            replace(part_path, stored)
+        _link(stored, dest_path)
+
+
+def release(dest_path: str) -> None:
+    r"""
+    Removes a staged image once it is exported, and its store entry if no other staged image
+    links it. An image staged several times under the same path is removed with its last release.
+
+    :param dest_path: path the image was staged at.
+    """
+    dest_path = path.normpath(dest_path)
+    with _lock:
+        entry = _staged.get(dest_path)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _staged[dest_path]
+        if path.exists(dest_path) and path.samefile(entry[0], dest_path):
+            remove(dest_path)
+        _remove_unlinked(entry[0])
+
+
+def prune_store() -> None:
+    r"""
+    Removes the store entries no staged image links anymore, and partial files, for eg. left by
+    a previous run of the component.
+    """
+    with _lock:
+        for directory, _, file_names in walk(config_utils.STAGING_STORE_DIR):
+            for file_name in file_names:
+                file_path = path.join(directory, file_name)
+                if file_name.endswith(".part"):
+                    remove(file_path)
+                else:
+                    _remove_unlinked(file_path)
+
+
+def _remove_unlinked(stored):
+    # Only the store links the entry. A hard linked entry is kept until the source image is deleted too
+    try:
+        if stat(stored).st_nlink == 1:
+            remove(stored)
+            METRICS.count("store_evicted")
+    except FileNotFoundError:
+        pass
+
+
+def _reflink_or_link(source_path, dest_path):
+    if path.exists(dest_path):
+        remove(dest_path)
+    try:
+        with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+            fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+        return "reflink"
+    except OSError:
+        # For eg. ext4, which has no reflinks
+        remove(dest_path)
+    link(source_path, dest_path)
+    return "link"
+
+
+def _copy_into_store(source_path, dest_path, extension):
+    digest = hashlib.sha256()
+    part_fd, part_path = mkstemp(suffix=".part", dir=config_utils.STAGING_STORE_DIR)
+    with open(source_path, "rb") as source, open(part_fd, "wb") as part:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            part.write(chunk)
+    stored = store_path(digest.hexdigest(), extension)
+    with _lock:
+        if path.exists(stored):
+            remove(part_path)
+            method = "stored"
+            METRICS.count("staged_duplicates")
+        else:
+            makedirs(path.dirname(stored), exist_ok=True)
+            replace(part_path, stored)
+            method = "copy"
+        _link(stored, dest_path)
+    return method
+
+
+def _link(stored, dest_path):
+    # The same staged path may be spelled differently by the callers of stage and release
+    dest_path = path.normpath(dest_path)
+    entry = _staged.setdefault(dest_path, [stored, 0])
+    if entry[0] != stored:
+        # An earlier image of the same name is replaced, its entry may now be unlinked
+        previous, entry[0] = entry[0], stored
+    else:
+        previous = None
+    entry[1] += 1
+    if path.exists(dest_path) and path.samefile(stored, dest_path):
+        return
+    # Replaces an earlier image of the same name
+    part_path = dest_path + ".part"
+    if path.exists(part_path):
+        remove(part_path)
+    link(stored, part_path)
+    rename(part_path, dest_path)
+    if previous is not None:
+        _remove_unlinked(previous)
@@ -0,0 +1,106 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from os import path
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+from frame_cache import FRAME_CACHE
+from metrics import METRICS
+
+# Keys of the S3 object metadata which record the transform, read by the training preprocessing
+METADATA_LEFT = "transform-left"
+METADATA_TOP = "transform-top"
+METADATA_SCALE_X = "transform-scale-x"
+METADATA_SCALE_Y = "transform-scale-y"
+METADATA_GRAYSCALE = "transform-grayscale"
+METADATA_QUALITY = "transform-quality"
+METADATA_ORIGINAL_WIDTH = "original-width"
+METADATA_ORIGINAL_HEIGHT = "original-height"
+
+
+class UploadTransform:
+    r"""
+    Re-encodes the frames uploaded to S3 to save bandwidth on metered links. A frame is cropped to
+    the region of interest, downscaled so that its longer side fits the maximum dimension,
+    optionally converted to grayscale and encoded as JPEG of the given quality, in that order.
+
+    The transform is returned as S3 object metadata, so that boxes labeled on the uploaded frame
+    map back to the original frame with x = x' / scale-x + left and y = y' / scale-y + top.
+    """
+
+    def __init__(self, max_dimension: int = 0, jpeg_quality: int = 0, grayscale: bool = False, region=None):
+        r"""
+        :param max_dimension: maximum width and height in pixels. Frames are not downscaled if 0.
+        :param jpeg_quality: JPEG quality between 1 and 100. Frames are encoded with the OpenCV default of 95 if 0.
+        :param grayscale: converts the frames to grayscale.
+        :param region: optional [x, y, width, height] rectangle in pixels the frames are cropped to.
+        """
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self.grayscale = grayscale
+        self.region = region
+
+    def enabled(self) -> bool:
+        r"""
+        :return: False if the frames are uploaded byte for byte.
+        """
+        return self.max_dimension > 0 or self.jpeg_quality > 0 or self.grayscale or self.region is not None
+
+    def apply(self, image: np.ndarray) -> Tuple[bytes, Dict[str, str]]:
+        r"""
+        :param image: decoded frame, which is not modified.
+        :return: the transformed frame encoded as JPEG, and the S3 object metadata of the transform.
+        """
+        height, width = image.shape[:2]
+        left, top, right, bottom = 0, 0, width, height
+        if self.region is not None:
+            x, y, region_width, region_height = self.region
+            left, top = min(max(0, int(x)), width - 1), min(max(0, int(y)), height - 1)
+            right, bottom = max(min(width, int(x + region_width)), left + 1), max(min(height, int(y + region_height)), top + 1)
+        transformed = image[top:bottom, left:right]
+
+        crop_height, crop_width = transformed.shape[:2]
+        scale = 1.0
+        if self.max_dimension > 0:
+            scale = min(1.0, self.max_dimension / max(crop_width, crop_height))
+        if scale < 1.0:
+            transformed = cv2.resize(
+                transformed, (max(1, round(crop_width * scale)), max(1, round(crop_height * scale))),
+                interpolation=cv2.INTER_AREA)
+
+        if self.grayscale and transformed.ndim == 3:
+            transformed = cv2.cvtColor(transformed, cv2.COLOR_BGR2GRAY)
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality] if self.jpeg_quality > 0 else []
+        encoded = cv2.imencode(".jpg", transformed, params)[1].tobytes()
+
+        metadata = {
+            METADATA_LEFT: str(left),
+            METADATA_TOP: str(top),
+            # Ratios of the encoded size, which is rounded to whole pixels
+            METADATA_SCALE_X: repr(transformed.shape[1] / crop_width),
+            METADATA_SCALE_Y: repr(transformed.shape[0] / crop_height),
+            METADATA_GRAYSCALE: str(self.grayscale).lower(),
+            METADATA_QUALITY: str(self.jpeg_quality if self.jpeg_quality > 0 else 95),
+            METADATA_ORIGINAL_WIDTH: str(width),
+            METADATA_ORIGINAL_HEIGHT: str(height),
+        }
+        return encoded, metadata
+
+
+def transform_for_upload(image_path: str, image: np.ndarray, transform: UploadTransform) -> Tuple[bytes, Dict[str, str]]:
+    r"""
+    :param image_path: path of the image.
+    :param image: decoded image. Taken from the frame cache if None.
+    :param transform: the UploadTransform to apply.
+    :return: the transformed image encoded as JPEG, and the S3 object metadata of the transform.
+    """
+    if image is None:
+        image = FRAME_CACHE.get(image_path)
+    with METRICS.timer("upload_transform"):
+        data, metadata = transform.apply(image)
+    if path.isfile(image_path):
+        METRICS.count("upload_bytes_saved", path.getsize(image_path) - len(data))
+    return data, metadata
@@ -0,0 +1,260 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from queue import Empty, Queue
+from threading import Condition, Event, Lock, Thread
+from time import monotonic
+
+import config_utils
+from metrics import METRICS
+from stream_manager import (ExportDefinition, MessageStreamDefinition,
+                            NotEnoughMessagesException, ReadMessagesOptions,
+                            ResourceNotFoundException, S3ExportTaskDefinition,
+                            S3ExportTaskExecutorConfig, Status, StatusConfig,
+                            StatusLevel, StatusMessage, StrategyOnFull,
+                            StreamManagerClient, ValidationException)
+from stream_manager.util import Util
+
+
+class S3Uploader:
+    r"""
+    Uploads files to S3 through one StreamManager client and one S3 export stream for the lifetime
+    of the component. upload queues the file, a background thread appends the S3 export tasks to
+    the stream and another one follows the status stream of the exports, so that failed exports
+    are logged and counted. The export stream is only created if it does not exist yet, so tasks
+    queued by a previous run of the component are still exported.
+    """
+
+    def __init__(self, stream_name=config_utils.STREAM_NAME,
+                 status_stream_name=config_utils.STATUS_STREAM_NAME,
+                 queue_size=config_utils.UPLOAD_QUEUE_SIZE):
+        r"""
+        :param stream_name: name of the S3 export stream.
+        :param status_stream_name: name of the stream StreamManager reports the export status to.
+        :param queue_size: maximum number of files waiting to be appended to the export stream.
+        """
+        self.stream_name = stream_name
+        self.status_stream_name = status_stream_name
+        self._queue = Queue(max(1, queue_size))
+        self._client = None
+        self._lock = Lock()
+        # Append times and functions to call once the export of a file succeeded, by file URL
+        self._pending = {}
+        self._condition = Condition()
+        self._stop_event = Event()
+        self._threads = []
+
+    def start(self):
+        r"""
+        Starts the background threads, once.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [Thread(target=self._append_loop, name="s3-uploader", daemon=True),
+                             Thread(target=self._status_loop, name="s3-upload-status", daemon=True)]
+            for thread in self._threads:
+                thread.start()
+        METRICS.set_gauge("uploads_pending", self.pending)
+
+    def upload(self, local_path, s3_folder, metadata=None, on_exported=None):
+        r"""
+        Queues a file for upload. Blocks while the queue is full.
+
+        :param local_path: absolute path of the file.
+        :param s3_folder: key prefix of the object in the upload bucket.
+        :param metadata: optional dictionary of string values, stored as user metadata of the object.
+        :param on_exported: optional function called with the local path once the file is in S3, for eg. staging.release.
+        """
+        self.start()
+        self._queue.put((local_path, "{}{}".format(s3_folder, local_path.split("/")[-1]), metadata, on_exported))
+
+    def pending(self):
+        r"""
+        :return: number of files queued or appended to the export stream and not exported yet.
+        """
+        with self._condition:
+            return self._queue.qsize() + sum(len(appends) for appends in self._pending.values())
+
+    def flush(self, timeout=config_utils.TIMEOUT):
+        r"""
+        Waits until the queued files are appended to the export stream.
+
+        :param timeout: maximum number of seconds to wait.
+        :return: True if no file is queued anymore.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._queue.unfinished_tasks == 0, timeout)
+
+    def close(self, timeout=config_utils.TIMEOUT):
+        r"""
+        Appends the queued files and stops the background threads.
+
+        :param timeout: maximum number of seconds to wait for the queued files.
+        """
+        self.flush(timeout)
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def _connect(self):
+        with self._lock:
+            if self._client is None:
+                client = StreamManagerClient()
+                try:
+                    self._create_streams(client)
+                except Exception:
+                    client.close()
+                    raise
+                self._client = client
+                config_utils.logger.info(
+                    "Connected to StreamManager, exporting to S3 through {}".format(self.stream_name))
+            return self._client
+
+    def _disconnect(self, client):
+        with self._lock:
+            if self._client is client:
+                self._client = None
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def _create_streams(self, client):
+        status_stream = MessageStreamDefinition(
+            name=self.status_stream_name, strategy_on_full=StrategyOnFull.OverwriteOldestData,
+            max_size=config_utils.STATUS_STREAM_MAX_BYTES)
+        export_stream = MessageStreamDefinition(
+            name=self.stream_name, strategy_on_full=StrategyOnFull.OverwriteOldestData,
+            export_definition=ExportDefinition(
+                s3_task_executor=[
+                    S3ExportTaskExecutorConfig(
+                        identifier="S3TaskExecutor" + self.stream_name,
+                        status_config=StatusConfig(
+                            status_level=StatusLevel.INFO,
+                            status_stream_name=self.status_stream_name))
+                ]))
+        for definition in (status_stream, export_stream):
+            try:
+                client.describe_message_stream(definition.name)
+                # Keeps the messages of the stream, unlike deleting and creating it
+                client.update_message_stream(definition)
+            except ResourceNotFoundException:
+                client.create_message_stream(definition)
+
+    def _append_loop(self):
+        backoff_secs = config_utils.UPLOAD_RETRY_BACKOFF_SECS
+        while not self._stop_event.is_set():
+            try:
+                local_path, key, metadata, on_exported = self._queue.get(timeout=1)
+            except Empty:
+                continue
+            while not self._stop_event.is_set():
+                client = None
+                try:
+                    client = self._connect()
+                    self._append(client, local_path, key, metadata, on_exported)
+                    backoff_secs = config_utils.UPLOAD_RETRY_BACKOFF_SECS
+                    break
+                except ValidationException as e:
+                    # Retrying an invalid export task cannot succeed
+                    config_utils.logger.error(
+                        "Invalid S3 export task of {}: {}".format(local_path, e))
+                    METRICS.count("uploads_failed")
+                    break
+                except Exception as e:
+                    config_utils.logger.exception(
+                        "Error appending {} to {}, retrying in {}s: {}".format(
+                            local_path, self.stream_name, backoff_secs, e))
+                    if client is not None:
+                        self._disconnect(client)
+                    self._stop_event.wait(backoff_secs)
+                    backoff_secs = min(2 * backoff_secs, config_utils.UPLOAD_MAX_RETRY_BACKOFF_SECS)
+            with self._condition:
+                self._queue.task_done()
+                self._condition.notify_all()
+
+    def _append(self, client, local_path, key, metadata, on_exported):
+        file_url = "file://{}".format(local_path)
+        s3_export_task_definition = S3ExportTaskDefinition(
+            input_url=file_url, bucket=config_utils.UPLOAD_BUCKET_NAME, key=key, user_metadata=metadata)
+        with self._condition:
+            self._pending.setdefault(file_url, []).append((monotonic(), on_exported))
+        try:
+            sequence_number = client.append_message(
+                self.stream_name, Util.validate_and_serialize_to_json_bytes(s3_export_task_definition))
+        except Exception:
+            with self._condition:
+                self._discard(file_url)
+            raise
+        config_utils.logger.info(
+            "Appended S3 export task of {} with sequence number {}".format(local_path, sequence_number))
+
+    def _status_loop(self):
+        next_sequence_number = None
+        while not self._stop_event.is_set():
+            try:
+                client = self._connect()
+            except Exception as e:
+                config_utils.logger.error("Error connecting to StreamManager: {}".format(e))
+                self._stop_event.wait(config_utils.UPLOAD_RETRY_BACKOFF_SECS)
+                continue
+            try:
+                if next_sequence_number is None:
+                    # Statuses of the exports of previous runs are not followed
+                    newest = client.describe_message_stream(
+                        self.status_stream_name).storage_status.newest_sequence_number
+                    next_sequence_number = 0 if newest is None else newest + 1
+                messages = client.read_messages(self.status_stream_name, ReadMessagesOptions(
+                    desired_start_sequence_number=next_sequence_number, min_message_count=1,
+                    max_message_count=config_utils.STATUS_READ_BATCH_SIZE,
+                    read_timeout_millis=config_utils.STATUS_READ_TIMEOUT_MS))
+            except NotEnoughMessagesException:
+                continue
+            except Exception as e:
+                config_utils.logger.error(
+                    "Error reading the upload status from {}: {}".format(self.status_stream_name, e))
+                self._stop_event.wait(config_utils.UPLOAD_RETRY_BACKOFF_SECS)
+                continue
+            for message in messages:
+                next_sequence_number = message.sequence_number + 1
+                self._handle_status(Util.deserialize_json_bytes_to_obj(message.payload, StatusMessage))
+
+    def _handle_status(self, status_message):
+        task = status_message.status_context.s3_export_task_definition
+        if status_message.status == Status.Success:
+            METRICS.count("uploads_succeeded")
+            config_utils.logger.info("Exported {} to s3://{}/{}".format(task.input_url, task.bucket, task.key))
+        elif status_message.status in (Status.Failure, Status.Canceled):
+            METRICS.count("uploads_failed")
+            config_utils.logger.error("Export of {} to s3://{}/{} failed: {}".format(
+                task.input_url, task.bucket, task.key, status_message.message))
+        else:
+            return
+        with self._condition:
+            appended, on_exported = self._discard(task.input_url)
+        if appended is not None and status_message.status == Status.Success:
+            # From the append to the export stream until the file is in S3
+            METRICS.observe("upload", monotonic() - appended)
+        # A failed export keeps its file, for eg. to export it by hand
+        if on_exported is not None and status_message.status == Status.Success:
+            try:
+                on_exported(task.input_url[len("file://"):])
+            except Exception as e:
+                config_utils.logger.error("Error releasing {}: {}".format(task.input_url, e))
+
+    def _discard(self, file_url):
+        appends = self._pending.get(file_url)
+        if not appends:
+            return None, None
+        appended = appends.pop(0)
+        if not appends:
+            del self._pending[file_url]
+        return appended
+
+
+UPLOADER = S3Uploader()
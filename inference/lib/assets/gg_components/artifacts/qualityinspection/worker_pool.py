@@ -0,0 +1,169 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import multiprocessing
+from os import cpu_count
+from queue import Empty, Full
+from threading import Thread
+
+import config_utils
+
+
+def run_worker(tasks, results, engine, model_path, num_threads, infer_options):
+    r"""
+    Entry point of a worker process. Loads its own copy of the model and predicts the batches of
+    the task queue until it receives None.
+
+    :param tasks: queue of (sequence number, image paths, images) tuples.
+    :param results: queue to put (sequence number, image paths, images, box details, error) tuples to.
+    :param engine: name of the inference engine to load the model with.
+    :param model_path: path of the model artifact.
+    :param num_threads: number of threads the engine may use.
+    :param infer_options: keyword arguments of infer_batch.
+    """
+    # Imported here so that the parent process does not load the model stack twice
+    from frame_cache import FRAME_CACHE
+    from model_manager import LOADERS, warm_up
+    from prediction_utils import infer_batch
+
+    model = LOADERS[engine](model_path, num_threads=num_threads)
+    warm_up(model)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        sequence_number, image_paths, images = task
+        try:
+            decoded = [FRAME_CACHE.get_or_none(image_path) if image is None else image
+                       for image_path, image in zip(image_paths, images)]
+            # Images which cannot be read get no box details, the others are predicted as usual
+            readable = [index for index, image in enumerate(decoded) if image is not None]
+            boxes = [None] * len(decoded)
+            if readable:
+                predicted = infer_batch([decoded[index] for index in readable], model,
+                                        [image_paths[index] for index in readable], **infer_options)
+                for index, image_boxes in zip(readable, predicted):
+                    boxes[index] = image_boxes
+            results.put((sequence_number, image_paths, images, boxes, None))
+        except Exception as e:
+            results.put((sequence_number, image_paths, images, None, repr(e)))
+
+
+class WorkerPool:
+    r"""
+    Runs inference in a pool of worker processes, so that pre- and post-processing of several
+    batches run on several cores in parallel instead of being serialized by the GIL. Each worker
+    holds its own model session and pulls batches from a shared bounded task queue. A single
+    publisher thread in this process puts the results back into submission order and hands them
+    to the result handler.
+    """
+
+    def __init__(self, num_workers, model_key, handle_result, infer_options=None):
+        r"""
+        :param num_workers: number of worker processes.
+        :param model_key: inference engine, model path and file hash of the model to run, as returned by ModelManager.current_key.
+        :param handle_result: function called with the image path, the image, the box details and the tag of every predicted image, in submission order.
+        :param infer_options: keyword arguments of infer_batch, for eg. tile_size.
+        """
+        self.model_key = model_key
+        self.broken = False
+        self._handle_result = handle_result
+        self._submitted = 0
+        self._tags = {}
+        # Workers are spawned rather than forked, forking would copy the threads and IPC connection of this process
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue(maxsize=2 * num_workers)
+        self._results = context.Queue()
+        engine, model_path, _ = model_key
+        num_threads = max(1, (cpu_count() or 1) // num_workers)
+        self._workers = [context.Process(target=run_worker,
+                                         args=(self._tasks, self._results, engine, model_path, num_threads, infer_options or {}),
+                                         daemon=True)
+                         for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+        self._closed = False
+        self._publisher = Thread(target=self._publish_in_order)
+        self._publisher.start()
+        config_utils.logger.info(
+            "Started {} inference workers with {} threads each".format(num_workers, num_threads))
+
+    def submit(self, image_paths, images, tags=None):
+        r"""
+        Queues a batch for inference. Blocks while all workers are busy and the task queue is full.
+
+        :param image_paths: paths of the images.
+        :param images: decoded images, or None for images the workers should read from their path.
+        :param tags: optional objects, one per image, which stay in this process and are handed to the result handler with the results.
+        """
+        if tags is not None:
+            self._tags[self._submitted] = tags
+        while True:
+            try:
+                self._tasks.put((self._submitted, image_paths, images), timeout=1)
+                break
+            except Full:
+                if not any(worker.is_alive() for worker in self._workers):
+                    self.broken = True
+                    self._tags.pop(self._submitted, None)
+                    raise RuntimeError("All inference workers exited")
+        self._submitted += 1
+
+    def close(self):
+        r"""
+        Lets the workers finish the queued batches, publishes their results and stops the pool.
+        Workers of a broken pool are terminated instead.
+        """
+        if self.broken:
+            for worker in self._workers:
+                worker.terminate()
+        else:
+            for _ in self._workers:
+                self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._closed = True
+        self._publisher.join()
+
+    def _publish_in_order(self):
+        pending = {}
+        next_number = 0
+        while True:
+            try:
+                sequence_number, *result = self._results.get(timeout=1)
+                pending[sequence_number] = result
+            except Empty:
+                if self._closed:
+                    break
+                if not pending or all(worker.is_alive() for worker in self._workers):
+                    continue
+                # A worker died with a batch, do not wait for its result forever
+                config_utils.logger.error(
+                    "An inference worker exited unexpectedly, skipping its batch")
+                self.broken = True
+                for lost_number in range(next_number, min(pending)):
+                    self._tags.pop(lost_number, None)
+                next_number = min(pending)
+            while next_number in pending:
+                self._publish(next_number, *pending.pop(next_number))
+                next_number += 1
+
+        # Results which were waiting for a lost batch
+        for sequence_number in sorted(pending):
+            self._publish(sequence_number, *pending[sequence_number])
+
+    def _publish(self, sequence_number, image_paths, images, boxes, error):
+        tags = self._tags.pop(sequence_number, None) or [None] * len(image_paths)
+        if error is not None:
+            config_utils.logger.error(
+                "Error running the inference on {}: {}".format(image_paths, error))
+            return
+        for image_path, image, image_boxes, tag in zip(image_paths, images, boxes, tags):
+            if image_boxes is None:
+                # The image could not be read by the worker
+                continue
+            try:
+                self._handle_result(image_path, image, image_boxes, tag)
+            except Exception as e:
+                config_utils.logger.exception(
+                    "Error handling the inference results of {}: {}".format(image_path, e))
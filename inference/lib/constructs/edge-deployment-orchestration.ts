@@ -181,11 +181,11 @@ const asl = {
               },
               "Lifecycle": {
                 "Install": {
-                  "Script": "tar xzf {artifacts:path}/model.tar.gz -C {artifacts:decompressedPath}",
+                  "Script": "tar xzf {artifacts:path}/model.tar.gz -C {artifacts:decompressedPath} && mkdir -p {work:path}/staging && tar xzf {artifacts:path}/model.tar.gz -C {work:path}/staging && chmod -R a+rX {work:path} && mv -f {work:path}/staging/* {work:path}/",
                   "RequiresPrivilege": true
                 },
                 "Upgrade": {
-                  "Script": "tar xzf {artifacts:path}/model.tar.gz -C {artifacts:decompressedPath}",
+                  "Script": "tar xzf {artifacts:path}/model.tar.gz -C {artifacts:decompressedPath} && mkdir -p {work:path}/staging && tar xzf {artifacts:path}/model.tar.gz -C {work:path}/staging && chmod -R a+rX {work:path} && mv -f {work:path}/staging/* {work:path}/",
                   "RequiresPrivilege": true
                 },
                 "Uninstall": {
@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import sys
+import tempfile
+import unittest
+from os import path
+from unittest import mock
+
+WORK_DIR = tempfile.mkdtemp()
+for name in ("UPLOAD_DIR", "IMAGE_DIR", "INFERENCE_COMP_PATH", "MODEL_COMP_PATH"):
+    os.environ.setdefault(name, WORK_DIR)
+os.environ.setdefault("IMAGE_UPLOAD_BUCKET", "bucket")
+os.environ.setdefault("MODEL_NAME", "model.onnx")
+sys.path.insert(0, path.join(path.dirname(__file__), "..", "lib", "assets", "gg_components", "artifacts",
+                             "qualityinspection"))
+
+import config_utils  # noqa: E402
+import cv2  # noqa: E402
+import numpy  # noqa: E402
+import prediction_utils  # noqa: E402
+import staging  # noqa: E402
+
+
+class TestStaging(unittest.TestCase):
+
+    def setUp(self):
+        self.image_path = path.join(tempfile.mkdtemp(dir=WORK_DIR), "frame.jpg")
+        with open(self.image_path, "wb") as image:
+            image.write(os.urandom(1024))
+
+    def stage_and_export(self):
+        with mock.patch.object(prediction_utils.UPLOADER, "upload") as upload:
+            prediction_utils.upload_for_labeling(self.image_path, None)
+        local_path, _, _, on_exported = upload.call_args[0]
+        staged_path = path.join(config_utils.UPLOAD_DIR_LABELING, "frame.jpg")
+        stored = staging.store_path(staging.file_digest(self.image_path), ".jpg")
+        self.assertTrue(path.isfile(staged_path))
+        self.assertTrue(path.isfile(stored))
+        # As the uploader does once StreamManager reports the export as succeeded
+        on_exported(local_path)
+        return staged_path, stored
+
+    def test_exported_image_is_released(self):
+        staged_path, stored = self.stage_and_export()
+        self.assertFalse(path.exists(staged_path))
+        # A hard linked entry is kept until the source image is deleted too
+        os.remove(self.image_path)
+        staging.prune_store()
+        self.assertFalse(path.exists(stored))
+        self.assertEqual({}, staging._staged)
+
+    def test_copied_image_is_released(self):
+        with mock.patch.object(staging, "stat", side_effect=self.cross_device):
+            staged_path, stored = self.stage_and_export()
+        self.assertFalse(path.exists(staged_path))
+        self.assertFalse(path.exists(stored))
+        self.assertEqual({}, staging._staged)
+
+    def test_annotated_image_is_released(self):
+        image = numpy.zeros((32, 32, 3), dtype=numpy.uint8)
+        boxes = [[[0.9]], [[[16, 16, 8, 8]]]]
+        annotated_path = prediction_utils.generate_bounding_box_image(self.image_path, image, boxes)
+        self.assertFalse(path.exists(annotated_path + ".part"))
+        self.assertIsNotNone(cv2.imread(annotated_path))
+        staging.release(annotated_path)
+        self.assertFalse(path.exists(annotated_path))
+        self.assertEqual([], [name for _, _, names in os.walk(config_utils.STAGING_STORE_DIR) for name in names])
+
+    @staticmethod
+    def cross_device(file_path):
+        result = os.stat(file_path)
+        if path.abspath(file_path) == path.abspath(config_utils.STAGING_STORE_DIR):
+            return os.stat_result((result.st_mode, result.st_ino, result.st_dev + 1) + tuple(result)[3:])
+        return result
+
+
+if __name__ == "__main__":
+    unittest.main()
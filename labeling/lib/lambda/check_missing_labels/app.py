@@ -9,6 +9,7 @@ import logging
 import argparse
 from sagemaker.feature_store.feature_group import FeatureGroup
 import os
+import tarfile
 
 APPROVED_LABELS_QUERY = """
 SELECT *
@@ -20,6 +21,11 @@ FROM
 WHERE row_number = 1 AND status = 'APPROVED' AND NOT is_deleted 
 """
 
+BUNDLE_FILE_TYPES = ['.tar']
+BUNDLE_MANIFEST_NAME = 'manifest.json'
+# PAX header records of a bundle member which are stored as metadata of the unpacked object
+BUNDLE_METADATA_PREFIX = 'S3.metadata.'
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -46,6 +52,7 @@ def handler(event, context):
     logger.info(f"check-missing-labels called with event {event} and lambda config {lambda_config}")
 
     bucket, key = split_s3_url(lambda_config.input_images_s3uri)
+    unpack_bundles(bucket=bucket, prefix=key)
     images = get_list_of_files(
         bucket=bucket, prefix=key, file_types=['.jpg', '.png'])
 
@@ -79,6 +86,36 @@ def get_list_of_files(bucket=None, prefix=None, file_types=None):
     return filtered_files
 
 
+def unpack_bundles(bucket=None, prefix=None):
+    # Devices can upload the images to label as tar bundles, which end with a manifest of their images
+    bundles = get_list_of_files(bucket=bucket, prefix=prefix, file_types=BUNDLE_FILE_TYPES)
+    for bundle in bundles:
+        _, bundle_key = split_s3_url(bundle)
+        folder = bundle_key[:bundle_key.rfind('/') + 1]
+        body = s3_client.get_object(Bucket=bucket, Key=bundle_key)['Body']
+        unpacked = []
+        manifest = None
+        with tarfile.open(fileobj=body, mode='r|') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                data = archive.extractfile(member).read()
+                name = os.path.basename(member.name)
+                if name == BUNDLE_MANIFEST_NAME:
+                    manifest = json.loads(data)
+                    continue
+                # For eg. how the device re-encoded the image, to map labeled boxes back to the original frame
+                metadata = {key[len(BUNDLE_METADATA_PREFIX):]: value for key, value in member.pax_headers.items()
+                            if key.startswith(BUNDLE_METADATA_PREFIX)}
+                s3_client.put_object(Bucket=bucket, Key=f'{folder}{name}', Body=data, Metadata=metadata)
+                unpacked.append(name)
+        if manifest is not None and len(manifest['images']) != len(unpacked):
+            logger.warning(
+                f"Bundle {bundle} lists {len(manifest['images'])} images in its manifest, but {len(unpacked)} were unpacked")
+        s3_client.delete_object(Bucket=bucket, Key=bundle_key)
+        logger.info(f"Unpacked {len(unpacked)} images from bundle {bundle}")
+
+
 def is_allowed_file_type(file, file_types=None):
     allowed = False
     for file_type in file_types:
@@ -23,6 +23,10 @@ sagemaker_session = sagemaker.Session()
 logging.basicConfig(level=logging.INFO)
 
 FEATURE_S3URI = 'source_ref'
+# S3 object metadata of the images the edge device re-encoded before uploading them
+TRANSFORM_METADATA_KEYS = ['transform-left', 'transform-top', 'transform-scale-x', 'transform-scale-y',
+                           'transform-grayscale', 'transform-quality', 'original-width', 'original-height']
+TRANSFORMS_FILE_NAME = 'transforms.json'
 APPROVED_LABELS_QUERY = """
 SELECT *
 FROM
@@ -101,15 +105,32 @@ def _get_dataset(feature_group_name, query_results_s3uri):
     return df
 
 def download_file(file, path):
+    """
+    Downloads an image and returns its local path and its S3 object metadata, in one request.
+    """
+    metadata = {}
     try:
         bucket, key, filename = split_s3_url(file)
-        s3_client.download_file(bucket, key, f"{path}/{filename}")
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        with open(f"{path}/{filename}", 'wb') as fw:
+            for chunk in response['Body'].iter_chunks():
+                fw.write(chunk)
+        metadata = response.get('Metadata', {})
     except ClientError as ex:
         if ex.response['Error']['Code'] == 'NoSuchKey':
             print('No object found - returning empty')
         else:
             raise
-    return f"{path}/{filename}"
+    return f"{path}/{filename}", metadata
+
+def get_upload_transform(metadata):
+    """
+    Returns the transform the edge device applied to an image before uploading it, read from the
+    S3 object metadata of the image, or None if the image was uploaded as captured.
+    """
+    if not all(name in metadata for name in TRANSFORM_METADATA_KEYS):
+        return None
+    return {name: metadata[name] for name in TRANSFORM_METADATA_KEYS}
 
 def split_s3_url(s3_url):
     bucket = urlparse(s3_url, allow_fragments=False).netloc
@@ -118,12 +139,18 @@ def split_s3_url(s3_url):
     return bucket, key, filename
 
 def create_yolov5_dataset(df, path):
+    # The labels are in the coordinates of the uploaded images, which the dataset is made of.
+    # The upload transforms are kept with the dataset to map boxes back to the captured frames.
+    transforms = {}
     for i, (_, item) in enumerate(df.iterrows()):
         bucket, key, filename = split_s3_url(item['source_ref'])
         with open(f"{path}/{filename}".replace(".jpg", ".txt"), 'w+') as fw:
             if i % 100 == 0:
                 logging.info(f'Writing line {i} of {len(df)}')
-            file = download_file(item['source_ref'], path)
+            file, metadata = download_file(item['source_ref'], path)
+            transform = get_upload_transform(metadata)
+            if transform is not None:
+                transforms[filename] = transform
             img = read_image(file)
             annotations = json.loads(item['annotations'].replace("'", '"'))
             ids = np.array([annotation['class_id']
@@ -150,6 +177,10 @@ def create_yolov5_dataset(df, path):
                     b_height /= float(h)
                     line = f"{int(label[0])} {b_center_x} {b_center_y} {b_width} {b_height}\n"
                     fw.write(line)
+    if transforms:
+        logging.info(f"{len(transforms)} images were re-encoded on upload, writing their transforms to {TRANSFORMS_FILE_NAME}")
+        with open(f"{path}/{TRANSFORMS_FILE_NAME}", 'w') as fw:
+            json.dump(transforms, fw)
 
 def create_tarball(path, filename):
     with tarfile.open(f"{path}/{filename}", "w:gz") as tarball:
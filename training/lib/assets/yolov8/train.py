@@ -2,6 +2,16 @@ import argparse
 import os
 import tarfile
 import shutil
+from ast import literal_eval
+from glob import glob
+
+import cv2
+import numpy as np
+import onnx
+from onnxconverter_common import float16
+from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+                                      QuantType, quantize_dynamic,
+                                      quantize_static)
 from ultralytics import YOLO
 
 def check_tar_file_for_insecure_filenames(tar_file, target_dir):
@@ -13,12 +23,55 @@ def check_and_extract_tar(tar_file, target_dir):
     check_tar_file_for_insecure_filenames(tar_file, target_dir)
     tar_file.extractall(target_dir)
 
+class ImageCalibrationDataReader(CalibrationDataReader):
+    """Feeds letterboxed images to the static INT8 calibration, preprocessed like on the edge device."""
+    def __init__(self, image_paths, input_name, imgsz):
+        self.image_paths = iter(image_paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        image_path = next(self.image_paths, None)
+        if image_path is None:
+            return None
+        image = cv2.imread(image_path)
+        height, width = image.shape[:2]
+        scale = min(self.imgsz[0] / height, self.imgsz[1] / width)
+        new_height, new_width = round(height * scale), round(width * scale)
+        top, left = (self.imgsz[0] - new_height) // 2, (self.imgsz[1] - new_width) // 2
+        letterboxed = np.full((*self.imgsz, 3), 114, dtype=np.uint8)
+        letterboxed[top:top + new_height, left:left + new_width] = cv2.resize(image, (new_width, new_height))
+        tensor = letterboxed[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255
+        return {self.input_name: tensor}
+
+def export_model_variants(onnx_path, calibration_dir, calibration_images):
+    """Exports dynamically quantized INT8, statically quantized INT8 and FP16 variants next to the FP32 ONNX model."""
+    model = onnx.load(onnx_path)
+    input_name = model.graph.input[0].name
+    imgsz = literal_eval({prop.key: prop.value for prop in model.metadata_props}["imgsz"])
+    stem = os.path.splitext(onnx_path)[0]
+    variant_paths = [f"{stem}.int8.onnx", f"{stem}.int8-static.onnx", f"{stem}.fp16.onnx"]
+
+    print("Exporting dynamically quantized INT8 model...")
+    quantize_dynamic(onnx_path, variant_paths[0], weight_type=QuantType.QUInt8)
+
+    image_paths = sorted(glob(f"{calibration_dir}/*.jpg"))[:calibration_images]
+    print(f"Exporting statically quantized INT8 model calibrated on {len(image_paths)} validation images...")
+    quantize_static(onnx_path, variant_paths[1], ImageCalibrationDataReader(image_paths, input_name, imgsz),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+    print("Exporting FP16 model...")
+    onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), variant_paths[2])
+    return variant_paths
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--epochs', type=int, default=300)
     parser.add_argument('--batch_size', type=int, default=16, help='total batch size for all GPUs')
     parser.add_argument('--img_size', nargs='+', type=int, default=[450, 450], help='[train, test] image sizes')
     parser.add_argument('--export_to_onnx', type=bool, default=False)
+    parser.add_argument('--calibration_images', type=int, default=100, help='number of validation images to calibrate the static INT8 model with')
     parser.add_argument('--model_output_dir', type=str, default="/opt/ml/model", help="Directory where to store best model artifact for S3 upload")
     parser.add_argument("--train", type=str, default=os.environ["SM_CHANNEL_TRAIN"])
     parser.add_argument("--validation", type=str, default=os.environ["SM_CHANNEL_VALIDATION"])
@@ -48,6 +101,10 @@ if __name__ == '__main__':
         print("Exporting the re-trained Ultralytics YOLOv8 model to ONNX format...")
         model.export(format='onnx', imgsz=opt.img_size, dynamic=True)
 
+        # The model component ships all variants, the edge device picks one by configuration or benchmark
+        for variant_path in export_model_variants('runs/detect/train/weights/best.onnx', opt.validation, opt.calibration_images):
+            shutil.copy(variant_path, opt.model_output_dir)
+
     print(f"Copying the re-trained Ultralytics YOLOv8 model to {opt.model_output_dir} for S3 upload...")
     shutil.copy(f'runs/detect/train/weights/best.{"onnx" if opt.export_to_onnx else "pt"}', opt.model_output_dir)
 